@@ -3,6 +3,13 @@ from dotenv import load_dotenv
 from flask_migrate import Migrate
 import os
 from models import db, seed_data
+from cart_store import init_cart_store
+from query_stats import init_query_stats
+from scheduler import add_job
+from dispatch import run_batch_dispatch
+from order_events import sweep_and_publish
+from dashboard_counters import reconcile_dashboard_counters, fold_dashboard_counter_deltas
+from revenue_rollups import catch_up_revenue_rollups
 from controller import admin_bp, main_bp, customer_bp
 
 
@@ -12,8 +19,30 @@ def create_app():
     app.secret_key = os.environ.get("SECRET_KEY", "dev-key-production")
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URI") #Uses a .env to hide password (I'll help you set it up Raul)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["CART_STORE"] = os.environ.get("CART_STORE", "memory") # 'sqlite' when running several workers
+    app.config["CART_STORE_PATH"] = os.environ.get("CART_STORE_PATH")
+    app.config["CART_TTL_SECONDS"] = int(os.environ.get("CART_TTL_SECONDS", 2 * 60 * 60))
+    app.config["DISCOUNT_QUOTE_TTL_SECONDS"] = int(os.environ.get("DISCOUNT_QUOTE_TTL_SECONDS", 10 * 60))
+    app.config["SCHEDULER_ENABLED"] = os.environ.get("SCHEDULER_ENABLED", "1") == "1"
+    app.config["DISPATCH_MODE"] = os.environ.get("DISPATCH_MODE", "inline") # 'batch' = assign drivers in bulk every few seconds
+    app.config["DISPATCH_BATCH_INTERVAL_SECONDS"] = float(os.environ.get("DISPATCH_BATCH_INTERVAL_SECONDS", 5))
+    app.config["STATUS_SWEEP_INTERVAL_SECONDS"] = float(os.environ.get("STATUS_SWEEP_INTERVAL_SECONDS", 30))
+    app.config["REVENUE_ROLLUP_INTERVAL_SECONDS"] = float(os.environ.get("REVENUE_ROLLUP_INTERVAL_SECONDS", 60 * 60))
+    app.config["DASHBOARD_RECONCILE_INTERVAL_SECONDS"] = float(os.environ.get("DASHBOARD_RECONCILE_INTERVAL_SECONDS", 15 * 60))
+    app.config["DASHBOARD_FOLD_INTERVAL_SECONDS"] = float(os.environ.get("DASHBOARD_FOLD_INTERVAL_SECONDS", 10))
+    app.config["CACHE_PROBE_INTERVAL_SECONDS"] = float(os.environ.get("CACHE_PROBE_INTERVAL_SECONDS", 5)) # menu/discount/postal caches recheck the database this often
+    app.config["QUERY_STATS_ENABLED"] = os.environ.get("QUERY_STATS_ENABLED", "1") == "1" # Server-Timing header + a log line per request
+    app.config["QUERY_STATS_N_PLUS_ONE_THRESHOLD"] = int(os.environ.get("QUERY_STATS_N_PLUS_ONE_THRESHOLD", 10))
+    app.config["REPORT_CACHE_TTL_SECONDS"] = { # per process, "Refresh now" on a report page drops it
+        "undelivered": float(os.environ.get("UNDELIVERED_REPORT_TTL_SECONDS", 15)),
+        "top_pizzas": float(os.environ.get("TOP_PIZZAS_REPORT_TTL_SECONDS", 5 * 60)),
+        "earnings": float(os.environ.get("EARNINGS_REPORT_TTL_SECONDS", 5 * 60)),
+        "customers_with_orders": float(os.environ.get("CUSTOMERS_WITH_ORDERS_TTL_SECONDS", 5 * 60)),
+    }
 
     db.init_app(app)
+    init_cart_store(app)
+    init_query_stats(app)
     app.register_blueprint(main_bp)
     app.register_blueprint(customer_bp)
     app.register_blueprint(admin_bp)
@@ -24,6 +53,13 @@ def create_app():
         db.create_all()
         seed_data()
 
+    add_job(app, "order_status_sweeper", app.config["STATUS_SWEEP_INTERVAL_SECONDS"], sweep_and_publish)
+    add_job(app, "revenue_rollups_catch_up", app.config["REVENUE_ROLLUP_INTERVAL_SECONDS"], catch_up_revenue_rollups, run_now=True)
+    add_job(app, "dashboard_counters_fold", app.config["DASHBOARD_FOLD_INTERVAL_SECONDS"], fold_dashboard_counter_deltas)
+    add_job(app, "dashboard_counters_reconcile", app.config["DASHBOARD_RECONCILE_INTERVAL_SECONDS"], reconcile_dashboard_counters)
+    if app.config["DISPATCH_MODE"] == "batch":
+        add_job(app, "batch_dispatch", app.config["DISPATCH_BATCH_INTERVAL_SECONDS"], run_batch_dispatch)
+
     @app.route("/")
     def index():
         return ("<p>Pizzeria app. Supabase connection is working</p>")
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from flask import current_app, session
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+'''
+Server-side cart storage.
+The session cookie only carries an opaque cart id, the cart itself lives in a store:
+- MemoryCartStore: in-process LRU, fine for a single worker
+- SQLiteCartStore: local SQLite file shared by every worker on the machine
+Both stores drop carts that have not been touched for CART_TTL_SECONDS.
+'''
+
+DEFAULT_TTL_SECONDS = 2 * 60 * 60
+EVICT_EVERY_N_WRITES = 500
+
+
+class MemoryCartStore:
+    """In-process LRU of carts, the least recently used cart is dropped once max_carts is reached"""
+
+    def __init__(self, max_carts=10000, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_carts = max_carts
+        self.ttl_seconds = ttl_seconds
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, cart_id):
+        with self._lock:
+            entry = self._carts.get(cart_id)
+            if entry is None:
+                return {}
+            touched_at, cart = entry
+            if time.time() - touched_at > self.ttl_seconds:
+                del self._carts[cart_id]
+                return {}
+            self._carts.move_to_end(cart_id)
+            return json.loads(cart)
+
+    def save(self, cart_id, cart):
+        # Stored serialized so callers can never mutate a cart another request is reading
+        with self._lock:
+            self._carts[cart_id] = (time.time(), json.dumps(cart))
+            self._carts.move_to_end(cart_id)
+            while len(self._carts) > self.max_carts:
+                self._carts.popitem(last=False)
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY_N_WRITES == 0
+        if evict:
+            self.evict_expired()
+
+    def delete(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    def evict_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [cart_id for cart_id, (touched_at, _) in self._carts.items() if touched_at < cutoff]
+            for cart_id in expired:
+                del self._carts[cart_id]
+        return len(expired)
+
+
+class SQLiteCartStore:
+    """Carts in a local SQLite file, so every worker process on the machine sees the same carts"""
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cart ("
+            " cart_id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " touched_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cart_touched_at ON cart (touched_at)")
+        conn.commit()
+
+    def _connect(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, cart_id):
+        row = self._connect().execute(
+            "SELECT data, touched_at FROM cart WHERE cart_id = ?", (cart_id,)
+        ).fetchone()
+        if row is None:
+            return {}
+        data, touched_at = row
+        if time.time() - touched_at > self.ttl_seconds:
+            self.delete(cart_id)
+            return {}
+        return json.loads(data)
+
+    def save(self, cart_id, cart):
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO cart (cart_id, data, touched_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(cart_id) DO UPDATE SET data = excluded.data, touched_at = excluded.touched_at",
+            (cart_id, json.dumps(cart), time.time())
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % EVICT_EVERY_N_WRITES == 0:
+            self.evict_expired()
+
+    def delete(self, cart_id):
+        conn = self._connect()
+        conn.execute("DELETE FROM cart WHERE cart_id = ?", (cart_id,))
+        conn.commit()
+
+    def evict_expired(self):
+        conn = self._connect()
+        cursor = conn.execute("DELETE FROM cart WHERE touched_at < ?", (time.time() - self.ttl_seconds,))
+        conn.commit()
+        return cursor.rowcount
+
+
+def init_cart_store(app):
+    """Creates the cart store configured by CART_STORE ('memory' or 'sqlite')"""
+    backend = app.config.get('CART_STORE', 'memory')
+    ttl_seconds = app.config.get('CART_TTL_SECONDS', DEFAULT_TTL_SECONDS)
+
+    if backend == 'memory':
+        store = MemoryCartStore(app.config.get('CART_STORE_MAX_CARTS', 10000), ttl_seconds)
+    elif backend == 'sqlite':
+        path = app.config.get('CART_STORE_PATH') or os.path.join(app.instance_path, 'carts.sqlite3')
+        store = SQLiteCartStore(path, ttl_seconds)
+    else:
+        raise ValueError(f"Unknown CART_STORE '{backend}', use 'memory' or 'sqlite'")
+
+    app.extensions['cart_store'] = store
+    return store
+
+
+def _store():
+    return current_app.extensions['cart_store']
+
+
+def load_cart():
+    """The current customer's cart, {} when there is none"""
+    # Carts from before the server-side store still sit in the cookie, move them over once
+    legacy_cart = session.pop('cart', None)
+    if legacy_cart:
+        save_cart(legacy_cart)
+        return legacy_cart
+
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        return {}
+    return _store().get(cart_id)
+
+
+def save_cart(cart):
+    if not cart:
+        delete_cart()
+        return
+
+    cart_id = session.get('cart_id')
+    if not cart_id:
+        cart_id = secrets.token_urlsafe(16)
+        session['cart_id'] = cart_id
+    _store().save(cart_id, cart)
+
+
+def delete_cart():
+    cart_id = session.pop('cart_id', None)
+    if cart_id:
+        _store().delete(cart_id)
@@ -0,0 +1,133 @@
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from models import db
+import threading
+import time
+
+'''
+"Run this after a commit that changed those tables", shared by the in-process caches.
+One set of Session listeners serves every registration: before_flush looks at the types in
+session.new/dirty/deleted once per flush, do_orm_execute catches bulk writes by table name,
+after_commit runs the callbacks of the flagged registrations and after_soft_rollback forgets
+the flags.
+Commit hooks only see this process. A ChangeProbe catches everything else (other workers, SQL
+console/Supabase edits): at most every CACHE_PROBE_INTERVAL_SECONDS a read re-runs a fingerprint,
+one SELECT of aggregates (counts, max ids, sums, an md5 of the text columns) that returns a single
+row whatever the size of the tables, and invalidates the cache when the result moved.
+'''
+
+DEFAULT_PROBE_INTERVAL_SECONDS = 5
+
+_FLAGS = 'commit_hooks'
+
+
+class _CommitHook:
+    __slots__ = ('callback', 'models', 'deleted_models', 'tables', 'deleted_tables', 'changed')
+
+    def __init__(self, callback, models, deleted_models, tables, deleted_tables, changed):
+        self.callback = callback
+        self.models = frozenset(models)
+        self.deleted_models = frozenset(deleted_models)
+        self.tables = frozenset(tables)
+        self.deleted_tables = frozenset(deleted_tables)
+        self.changed = changed
+
+
+_hooks = []
+
+
+def flag_on_commit(callback, models=(), deleted_models=(), tables=(), deleted_tables=(), changed=None):
+    """
+    Calls callback() after a commit that
+    - added, changed or deleted an instance of `models` (only deleted for `deleted_models`),
+    - or ran a bulk INSERT/UPDATE/DELETE on `tables` (only DELETE for `deleted_tables`).
+    With `changed`, a flush touching `models` only counts when changed(session) is true as well
+    (for checks finer than the type of the objects, e.g. which attributes moved).
+    """
+    _hooks.append(_CommitHook(callback, models, deleted_models, tables, deleted_tables, changed))
+
+
+def _flag(session, hook):
+    session.info.setdefault(_FLAGS, set()).add(hook)
+
+
+@event.listens_for(Session, 'before_flush')
+def _flag_changes(session, flush_context, instances):
+    changed_types = {type(obj) for obj in session.new}
+    changed_types.update(type(obj) for obj in session.dirty)
+    deleted_types = {type(obj) for obj in session.deleted}
+    all_types = changed_types | deleted_types
+
+    for hook in _hooks:
+        if not deleted_types.isdisjoint(hook.deleted_models):
+            _flag(session, hook)
+        elif not all_types.isdisjoint(hook.models) and (hook.changed is None or hook.changed(session)):
+            _flag(session, hook)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _flag_bulk_writes(orm_execute_state):
+    is_delete = orm_execute_state.is_delete
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or is_delete):
+        return
+    table_name = getattr(getattr(orm_execute_state.statement, 'table', None), 'name', None)
+    if table_name is None:
+        return
+    for hook in _hooks:
+        if table_name in hook.tables or (is_delete and table_name in hook.deleted_tables):
+            _flag(orm_execute_state.session, hook)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_on_commit(session):
+    for hook in session.info.pop(_FLAGS, ()):
+        hook.callback()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_on_rollback(session, previous_transaction):
+    session.info.pop(_FLAGS, None)
+
+
+#-------------------------Cross-process changes------------------------------------------------------------
+def aggregate_fingerprint(*aggregates):
+    """One row with every aggregate (each over a single table) as a scalar subquery of the same SELECT"""
+    return tuple(db.session.execute(
+        db.select(*(db.select(aggregate).scalar_subquery() for aggregate in aggregates))
+    ).one())
+
+
+def text_digest(column, order_by):
+    """md5 of a text column in order_by order, computed in Postgres. SQLite (local dev) returns the joined text"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.md5(func.string_agg(column, aggregate_order_by('\x1f', order_by)))
+    return func.group_concat(column, '\x1f')
+
+
+class ChangeProbe:
+    def __init__(self, fingerprint, on_change):
+        self.fingerprint = fingerprint
+        self.on_change = on_change
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._last = None
+
+    def check(self):
+        """Call before reading the cache, one caller per interval runs the fingerprint query, the others return right away"""
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now < self._next_check:
+                return
+            interval = current_app.config.get('CACHE_PROBE_INTERVAL_SECONDS', DEFAULT_PROBE_INTERVAL_SECONDS)
+            self._next_check = now + interval
+            fingerprint = self.fingerprint()
+            # The first probe runs before anything is loaded, so there is nothing to invalidate yet
+            if self._last is not None and fingerprint != self._last:
+                self.on_change()
+            self._last = fingerprint
+        finally:
+            self._lock.release()
@@ -1,9 +1,22 @@
-from flask import Blueprint, app, render_template, request, redirect, url_for, flash, session
-from models import db, Customer, Order, OrderItem, DeliveryPerson, DiscountCode, DiscountType, Admin, Pizza, pizza_ingredient, Ingredient, DeliveryPersonPostalRange
+from flask import Blueprint, app, render_template, request, redirect, url_for, flash, session, make_response, abort, current_app, Response, stream_with_context
+from markupsafe import Markup
+from models import db, Customer, Order, OrderItem, DeliveryPerson, DiscountCode, DiscountType, Admin, Pizza, pizza_ingredient, Ingredient, OUT_FOR_DELIVERY_AFTER_MINUTES, DELIVERED_AFTER_MINUTES
+from query_stats import count_queries
+from dispatch import allocate_delivery_person, STEP_POSTAL_RANGE, STEP_ANY_AVAILABLE
+from discounts import get_discount_code, make_quote, read_quote
+from cart_store import load_cart, save_cart, delete_cart
+from order_events import status_stream, wait_for_new_orders
+from dashboard_counters import get_dashboard_counts
+from report_cache import cached_report, report_cache
+from exports import export_orders, export_customers, export_undelivered, export_earnings, export_pizza_sales, EXPORT_FORMATS, EARNINGS_SEGMENTS
+from revenue_rollups import record_order_revenue, record_pizza_sales, revenue_report, top_pizzas_report, AGE_BUCKETS
+from menu import get_menu, get_menu_row, price_pizzas, get_menu_version, get_menu_etag_base
 from werkzeug.security import check_password_hash, generate_password_hash
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy import func, insert, or_, and_
 import os
+import hashlib
+import time
 from datetime import datetime, timedelta, timezone, date
 from sqlalchemy.orm import joinedload
 from zoneinfo import ZoneInfo
@@ -33,61 +46,22 @@ This is a helper method to assign delivery persons based on the postal code
 '''
 def _choose_delivery_person_for_zip(postal_code):
     """
-    This is a helper method to assign delivery persons based on the postal code 
+    This is a helper method to assign delivery persons based on the postal code (see dispatch.py)
     """
-    try:
-        pc = int(str(postal_code).strip())
-    except (TypeError, ValueError):
-        pc = None
-
-    cooldown_threshold = datetime.now(timezone.utc) - timedelta(minutes=30)
-
-    # First, try to find a delivery person for the specific postal code
-    if pc is not None:
-        dp = (DeliveryPerson.query
-              .join(DeliveryPersonPostalRange,
-                    DeliveryPersonPostalRange.delivery_person_id == DeliveryPerson.delivery_person_id)
-              .filter(
-                  DeliveryPersonPostalRange.start_zip <= pc,
-                  DeliveryPersonPostalRange.end_zip >= pc
-              )
-              .filter(
-                  (DeliveryPerson.last_assigned_at.is_(None)) |
-                  (DeliveryPerson.last_assigned_at <= cooldown_threshold)
-              )
-              .order_by(func.random())
-              .first())
-        
-        if dp:
-            print(f"✅ Found delivery person {dp.name} for postal code {pc}")
-            return dp
-        else:
-            print(f"⚠️ No delivery person found for postal code {pc} (checking cooldown)")
-    
-    # If no delivery person found for postal code, assign ANY available delivery person
-    dp = (DeliveryPerson.query
-          .filter(
-              (DeliveryPerson.last_assigned_at.is_(None)) |
-              (DeliveryPerson.last_assigned_at <= cooldown_threshold)
-          )
-          .order_by(func.random())
-          .first())
-    
-    if dp:
+    allocation = allocate_delivery_person(postal_code)
+    dp = allocation.delivery_person
+    
+    if dp is None:
+        print("❌ No delivery persons found in database!")
+    elif allocation.step == STEP_POSTAL_RANGE:
+        print(f"✅ Found delivery person {dp.name} for postal code {postal_code}")
+    elif allocation.step == STEP_ANY_AVAILABLE:
         print(f"✅ Assigned fallback delivery person: {dp.name}")
-        return dp
-    
-    # If all delivery persons are on cooldown, assign one anyway (oldest assignment)
-    dp = (DeliveryPerson.query
-          .order_by(DeliveryPerson.last_assigned_at.asc().nullsfirst())
-          .first())
-    
-    if dp:
+    else:
         print(f"⚠️ All delivery persons busy - assigned {dp.name} (cooldown override)")
-        return dp
+    print(f"Dispatch took {allocation.elapsed_ms:.1f} ms over {allocation.queries} queries")
     
-    print("❌ No delivery persons found in database!")
-    return None
+    return dp
 
 #-------------------------------
 
@@ -229,30 +203,21 @@ def logout():
     return redirect(url_for('main.index'))
 
 
-'''
-This is a helper method, helping for the checkout trasnaction. It calculates the pizza price 
-Based on the ingredients
-'''
-def compute_pizza_price(pizza):
-    """Calculate pizza price based on ingredients + 40% margin + 9% VAT"""
-    pizza_ingredients = db.session.query(
-        Ingredient.ingredient_id,
-        Ingredient.name,
-        Ingredient.cost
-    ).join(
-        pizza_ingredient,
-        pizza_ingredient.c.ingredient_id == Ingredient.ingredient_id
-    ).filter(
-        pizza_ingredient.c.pizza_id == pizza.pizza_id
-    ).all()
+# The menu grid is the same for every customer, so it is rendered once per menu version
+_menu_fragment = {'version': None, 'html': None}
+
+def _render_menu_grid():
+    version = get_menu_version()
+    if _menu_fragment['version'] != version:
+        html = Markup(render_template("customer_app_menu.html", pizzas=get_menu()))
+        _menu_fragment.update(version=version, html=html)
+        return html
+    return _menu_fragment['html']
 
-    base_cost = sum(float(ing.cost) for ing in pizza_ingredients) 
-    
-    price_with_margin = base_cost * 1.40
-    
-    final_price = price_with_margin * 1.09
-    
-    return round(final_price, 1)
+
+def _customer_app_etag(cart):
+    raw = f"{get_menu_etag_base()}:{session['customer_id']}:{session.get('customer_name', '')}:{len(cart)}"
+    return hashlib.sha1(raw.encode()).hexdigest()
 
 
 #App route for the customers
@@ -262,47 +227,31 @@ def app():
         flash('You are required to login to access the app.', 'error')
         return redirect(url_for('customer.login'))
     
-    pizzas = Pizza.query.options(joinedload(Pizza.ingredients)).order_by(Pizza.pizza_id.asc()).all()
+    # Pending flash messages are part of the page, so only skip the render when there are none
+    cart = load_cart()
+    etag = _customer_app_etag(cart)
+    has_flashes = bool(session.get('_flashes'))
+    if not has_flashes and etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
-    pizza_data = []
-    for pizza in pizzas:
-        is_vegetarian = True
-        ingredient_names = []
-        
-        if pizza.ingredients:
-            for ingredient in pizza.ingredients:
-                ingredient_names.append(ingredient.name)
-                if not ingredient.vegetarian:
-                    is_vegetarian = False
-        
-        if ingredient_names:
-            if len(ingredient_names) <= 3:
-                ingredients_text = ', '.join(ingredient_names)
-            else:
-                ingredients_text = ', '.join(ingredient_names[:3]) + ' and more...'
-        else:
-            ingredients_text = 'Delicious pizza with premium ingredients'
-        
-        dynamic_price = compute_pizza_price(pizza)
-        
-        pizza_info = {
-            'pizza_id': pizza.pizza_id,
-            'name': pizza.name,
-            'price': dynamic_price, 
-            'is_vegetarian': is_vegetarian,
-            'ingredients_text': ingredients_text,
-            'ingredient_count': len(ingredient_names) if ingredient_names else 0
-        }
-        pizza_data.append(pizza_info)
+    menu_html = _render_menu_grid()
     
     customer = Customer.query.get(session['customer_id'])
     
     customer_first_name = customer.first_name if customer else session.get('customer_name', '').split()[0]
     
-    return render_template("customer_app.html", 
-                         pizzas=pizza_data, 
+    response = make_response(render_template("customer_app.html", 
+                         menu_html=menu_html, 
+                         cart_count=len(cart),
                          customer=customer,
-                         customer_first_name=customer_first_name)
+                         customer_first_name=customer_first_name))
+    if not has_flashes:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 
@@ -312,7 +261,7 @@ def checkout():
     if 'customer_id' not in session:
         return redirect(url_for('customer.login'))
     
-    cart = session.get('cart', {})
+    cart = load_cart()
     if not cart:
         flash('Your cart is empty!', 'error')
         return redirect(url_for('customer.app'))
@@ -344,117 +293,102 @@ def checkout():
         notes = request.form.get('notes', '')
         discount_code_input = request.form.get('discount_code', '').strip().upper()
         
-        dp = _choose_delivery_person_for_zip(customer.postal_code if customer else None)
-        
-        try:
-            
-            final_total = total_with_vat
-            applied_discount_code_id = None
-            discount_was_applied = False
-            pizzas_added_to_loyalty = False 
-            
-            if discount_code_input:
-                is_eligible, message, discount_type, birthday_discount_amount = check_discount_eligibility(
-                    session['customer_id'], 
-                    discount_code_input, 
-                    cart
-                )
+        # Everything below is one transaction: no re-reads of rows we already hold, items go in as one executemany
+        with count_queries() as queries:
+            try:
+                # In batch mode the dispatch job assigns a driver a few seconds later
+                if current_app.config.get('DISPATCH_MODE') == 'batch':
+                    dp = None
+                else:
+                    dp = _choose_delivery_person_for_zip(customer.postal_code if customer else None)
                 
-                if is_eligible and discount_type:
-                    if discount_type.name == "Birthday Discount":
-                        discount_amount = float(birthday_discount_amount)
-                    else:
-                        discount_percent = float(discount_type.percent)
-                        discount_amount = total_with_vat * (discount_percent / 100)
-                    
-                    final_total = total_with_vat - discount_amount
+                final_total = total_with_vat
+                applied_discount_code_id = None
+                
+                if discount_code_input:
+                    # A quote from validate_discount only needs a cheap re-check, otherwise evaluate from scratch
+                    eligibility = _discount_from_quote(request.form.get('discount_quote'), customer, cart, discount_code_input)
+                    if eligibility is None:
+                        eligibility = check_discount_eligibility(
+                            session['customer_id'], 
+                            discount_code_input, 
+                            cart,
+                            customer=customer
+                        )
+                    is_eligible, message, discount_type, birthday_discount_amount, code = eligibility
                     
-                    code_obj = DiscountCode.query.filter_by(code=discount_code_input).first()
-                    if code_obj:
-                        applied_discount_code_id = code_obj.discount_code_id
-                        discount_was_applied = True
+                    if is_eligible and discount_type:
+                        if discount_type.name == "Birthday Discount":
+                            discount_amount = float(birthday_discount_amount)
+                        else:
+                            discount_percent = float(discount_type.percent)
+                            discount_amount = total_with_vat * (discount_percent / 100)
+                        
+                        final_total = total_with_vat - discount_amount
+                        applied_discount_code_id = code.discount_code_id
                         flash(f" {message} - You saved ${discount_amount:.2f}!", "success")
-                    else:
-                        flash("Error: Could not apply discount code", "error")
-                    
-                    if discount_type.name == "Loyalty Reward":
-                        pizzas_used_for_discount = 10
-                        remaining_pizzas = total_pizza_count - pizzas_used_for_discount
                         
-                        if remaining_pizzas > 0:
-                            customer.loyalty_pizza_count = remaining_pizzas
+                        if discount_type.name == "Loyalty Reward":
+                            pizzas_used_for_discount = 10
+                            remaining_pizzas = total_pizza_count - pizzas_used_for_discount
+                            customer.loyalty_pizza_count = remaining_pizzas if remaining_pizzas > 0 else 0
+                            print(f"Loyalty discount used. Pizza count reset to {customer.loyalty_pizza_count}")
                         else:
-                            customer.loyalty_pizza_count = 0
-                        
-                        pizzas_added_to_loyalty = True
-                        print(f"Loyalty discount used. Pizza count reset to {customer.loyalty_pizza_count}")
+                            customer.add_pizzas_to_count(total_pizza_count)
                     else:
+                        flash(f"{message}", "error")
                         customer.add_pizzas_to_count(total_pizza_count)
-                        pizzas_added_to_loyalty = True
-                        print(f"Added {total_pizza_count} pizzas. New loyalty count: {customer.loyalty_pizza_count}")
                 else:
-                    flash(f"{message}", "error")
                     customer.add_pizzas_to_count(total_pizza_count)
-                    pizzas_added_to_loyalty = True
-                    print(f"Discount failed. Added {total_pizza_count} pizzas. New count: {customer.loyalty_pizza_count}")
-            else:
-                customer.add_pizzas_to_count(total_pizza_count)
-                pizzas_added_to_loyalty = True
-                print(f" No discount code. Added {total_pizza_count} pizzas. New count: {customer.loyalty_pizza_count}")
-            
-            if not pizzas_added_to_loyalty:
-                customer.add_pizzas_to_count(total_pizza_count)
-                print(f" Safety net triggered. Added {total_pizza_count} pizzas. Count: {customer.loyalty_pizza_count}")
-            
-            # Create the order
-            new_order = Order(
-                customer_id=session['customer_id'],
-                delivery_person_id=(dp.delivery_person_id if dp else None),
-                total_price=final_total,
-                discount_code_id=applied_discount_code_id,
-                time_stamp=datetime.now(timezone.utc)
-            )
-            
-            db.session.add(new_order)
-            db.session.flush()
-            
-            print(f"Order created: order_id={new_order.order_id}, discount_code_id={new_order.discount_code_id}, total={new_order.total_price}")
-            
-            # Create order items
-            for pizza_id, item in cart.items():
-                order_item = OrderItem(
-                    order_id=new_order.order_id,
-                    pizza_id=int(pizza_id),
-                    quantity=item['quantity'],
-                    unit_price=item['price']
+                
+                now = datetime.now(timezone.utc)
+                
+                new_order = Order(
+                    customer_id=session['customer_id'],
+                    delivery_person_id=(dp.delivery_person_id if dp else None),
+                    total_price=final_total,
+                    discount_code_id=applied_discount_code_id,
+                    time_stamp=now
                 )
-                db.session.add(order_item)
-            
-            if dp:
-                dp.last_assigned_at = datetime.now(timezone.utc)
-                db.session.add(dp)
-            
-            db.session.commit()
-            
-            # Verify
-            saved_order = Order.query.get(new_order.order_id)
-            refreshed_customer = Customer.query.get(customer.customer_id)
-            print(f"Verified: discount_code_id={saved_order.discount_code_id}")
-            print(f"Final loyalty pizza count: {refreshed_customer.loyalty_pizza_count}")
-            
-            # Clear cart
-            session.pop('cart', None)
-            
-            flash('Order placed successfully!', 'success')
-            return redirect(url_for('customer.order_confirmation', order_id=new_order.order_id))
-            
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error processing order: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            flash(f'Error processing order: {str(e)}', 'error')
-            return redirect(url_for('customer.checkout'))
+                db.session.add(new_order)
+                
+                if dp:
+                    dp.last_assigned_at = now
+                
+                # Flushes the customer/driver updates and the order INSERT ... RETURNING order_id
+                db.session.flush()
+                order_id = new_order.order_id
+                loyalty_pizza_count = customer.loyalty_pizza_count
+                
+                db.session.execute(insert(OrderItem), [
+                    {
+                        'order_id': order_id,
+                        'pizza_id': int(pizza_id),
+                        'quantity': item['quantity'],
+                        'unit_price': item['price']
+                    }
+                    for pizza_id, item in cart.items()
+                ])
+                record_order_revenue(new_order, customer)
+                record_pizza_sales(new_order, cart)
+                
+                db.session.commit()
+                
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error processing order: {str(e)}")
+                import traceback
+                traceback.print_exc()
+                flash(f'Error processing order: {str(e)}', 'error')
+                return redirect(url_for('customer.checkout'))
+        
+        print(f"Order {order_id} placed in {queries.count} queries ({queries.elapsed_ms:.1f} ms), "
+              f"discount_code_id={applied_discount_code_id}, loyalty pizza count={loyalty_pizza_count}")
+        
+        delete_cart()
+        
+        flash('Order placed successfully!', 'success')
+        return redirect(url_for('customer.order_confirmation', order_id=order_id))
     
     return render_template('customer_checkout.html',
                          customer=customer,
@@ -522,73 +456,130 @@ def customer_orders():
   
    return render_template('customer_orders.html', orders=order_list)
 
-# Adding stuff to the cart
-@customer_bp.route('/customer/cart/add', methods=['POST'])
-def add_to_cart():
+def _event_stream_response(orders):
+    response = Response(status_stream(orders), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let a proxy buffer the stream
+    return response
+
+# Live status of one order (Server-Sent Events), replaces reloading the page
+@customer_bp.route('/customer/orders/<int:order_id>/events')
+def order_events(order_id):
     if 'customer_id' not in session:
-        return redirect(url_for('customer.login'))
-    
-    pizza_id = request.form.get('pizza_id')
-    quantity = int(request.form.get('quantity', 1))
+        abort(401)
     
-    if quantity <= 0:
-        flash('Please select a valid quantity', 'error')
-        return redirect(url_for('customer.app'))
-    
-    pizza = Pizza.query.get_or_404(pizza_id)
+    order = db.session.query(Order.customer_id, Order.status, Order.time_stamp).filter(Order.order_id == order_id).first()
+    if order is None or order.customer_id != session['customer_id']:
+        abort(404)
     
-    dynamic_price = compute_pizza_price(pizza)
+    return _event_stream_response({order_id: (order.status, order.time_stamp)})
 
+# Live status of all the customer's open orders in one stream (the orders page)
+@customer_bp.route('/customer/orders/events')
+def customer_order_events():
+    if 'customer_id' not in session:
+        abort(401)
     
-    is_vegetarian = True
-    for ingredient in pizza.ingredients:
-        if not ingredient.vegetarian:
-            is_vegetarian = False
-            break
+    open_orders = db.session.query(Order.order_id, Order.status, Order.time_stamp).filter(
+        Order.customer_id == session['customer_id'],
+        Order.effective_status != 'delivered'
+    ).all()
+    if not open_orders:
+        return '', 204  # tells EventSource to stop reconnecting
     
-    if 'cart' not in session:
-        session['cart'] = {}
+    return _event_stream_response({order.order_id: (order.status, order.time_stamp) for order in open_orders})
+
+#-------------------------Cart helpers------------------------------------------------------------
+def _add_pizza_to_cart(pizza, quantity):
+    """Adds a menu row to the customer's cart and returns the updated cart"""
+    pizza_id = str(pizza.pizza_id)
     
-    cart = session['cart']
+    cart = load_cart()
     if pizza_id in cart:
         cart[pizza_id]['quantity'] += quantity
     else:
         cart[pizza_id] = {
             'name': pizza.name,
-            'price': dynamic_price,  
+            'price': pizza.price,  
             'quantity': quantity,
-            'is_vegetarian': is_vegetarian
+            'is_vegetarian': pizza.is_vegetarian
         }
     
-    session['cart'] = cart
-    flash(f'Added {quantity} {pizza.name} to cart!', 'success')
-    return redirect(url_for('customer.app'))
+    save_cart(cart)
+    return cart
 
-# This makes sure that the customers can see theit cart
-@customer_bp.route('/customer/cart')
-def view_cart():
-    if 'customer_id' not in session:
-        return redirect(url_for('customer.login'))
-    
-    cart = session.get('cart', {})
+
+def _cart_summary(cart):
+    """Line items and totals of a cart, shared by the cart page and the JSON cart endpoints"""
     cart_items = []
     total = 0
+    pizza_count = 0
     
     for pizza_id, item in cart.items():
         subtotal = item['price'] * item['quantity']
         total += subtotal
+        pizza_count += item['quantity']
         cart_items.append({
             'pizza_id': pizza_id,
             'name': item['name'],
             'price': item['price'],
             'quantity': item['quantity'],
-            'subtotal': subtotal,
+            'subtotal': round(subtotal, 2),
             'is_vegetarian': item['is_vegetarian']
         })
     
+    return {
+        'items': cart_items,
+        'total': round(total, 2),
+        'count': len(cart_items),
+        'pizza_count': pizza_count
+    }
+
+
+def _parse_cart_request():
+    """pizza_id / quantity from either a form post or a JSON body"""
+    data = request.get_json(silent=True) if request.is_json else request.form
+    data = data or {}
+    try:
+        pizza_id = int(data.get('pizza_id'))
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        return None, None
+    return pizza_id, quantity
+
+#-------------------------------
+
+# Adding stuff to the cart
+@customer_bp.route('/customer/cart/add', methods=['POST'])
+def add_to_cart():
+    if 'customer_id' not in session:
+        return redirect(url_for('customer.login'))
+    
+    pizza_id, quantity = _parse_cart_request()
+    
+    if pizza_id is None or quantity <= 0:
+        flash('Please select a valid quantity', 'error')
+        return redirect(url_for('customer.app'))
+    
+    pizza = get_menu_row(pizza_id)
+    if pizza is None:
+        abort(404)
+    
+    _add_pizza_to_cart(pizza, quantity)
+    flash(f'Added {quantity} {pizza.name} to cart!', 'success')
+    return redirect(url_for('customer.app'))
+
+# This makes sure that the customers can see theit cart
+@customer_bp.route('/customer/cart')
+def view_cart():
+    if 'customer_id' not in session:
+        return redirect(url_for('customer.login'))
+    
+    summary = _cart_summary(load_cart())
+    
     return render_template('customer_cart.html', 
-                         cart_items=cart_items, 
-                         total=total)
+                         cart_items=summary['items'], 
+                         total=summary['total'])
 
 # Route that allows to remove stuff from the cart
 @customer_bp.route('/customer/cart/remove', methods=['POST'])
@@ -597,11 +588,11 @@ def remove_from_cart():
         return redirect(url_for('customer.login'))
     
     pizza_id = request.form.get('pizza_id')
-    cart = session.get('cart', {})
+    cart = load_cart()
     
     if pizza_id in cart:
         del cart[pizza_id]
-        session['cart'] = cart
+        save_cart(cart)
         flash('Item removed from cart', 'success')
     
     return redirect(url_for('customer.view_cart'))
@@ -612,87 +603,112 @@ def clear_cart():
     if 'customer_id' not in session:
         return redirect(url_for('customer.login'))
     
-    session.pop('cart', None)
+    delete_cart()
     flash('Cart cleared', 'success')
     return redirect(url_for('customer.app'))
 
+#-------------------------JSON cart endpoints (used by the menu and cart pages, no redirect/re-render)-------------
+@customer_bp.route('/customer/api/cart', methods=['GET'])
+def cart_summary_json():
+    if 'customer_id' not in session:
+        return {'error': 'Please log in first'}, 401
+    
+    return _cart_summary(load_cart()), 200
+
+
+@customer_bp.route('/customer/api/cart/add', methods=['POST'])
+def add_to_cart_json():
+    if 'customer_id' not in session:
+        return {'error': 'Please log in first'}, 401
+    
+    pizza_id, quantity = _parse_cart_request()
+    
+    if pizza_id is None or quantity <= 0:
+        return {'error': 'Please select a valid quantity'}, 400
+    
+    pizza = get_menu_row(pizza_id)
+    if pizza is None:
+        return {'error': 'Pizza not found'}, 404
+    
+    cart = _add_pizza_to_cart(pizza, quantity)
+    
+    summary = _cart_summary(cart)
+    summary['message'] = f'Added {quantity} {pizza.name} to cart!'
+    return summary, 200
+
 
-def check_discount_eligibility(customer_id, discount_code, cart):
+@customer_bp.route('/customer/api/cart/remove', methods=['POST'])
+def remove_from_cart_json():
+    if 'customer_id' not in session:
+        return {'error': 'Please log in first'}, 401
+    
+    pizza_id, _ = _parse_cart_request()
+    cart = load_cart()
+    
+    if pizza_id is not None and str(pizza_id) in cart:
+        del cart[str(pizza_id)]
+        save_cart(cart)
+    
+    summary = _cart_summary(cart)
+    summary['message'] = 'Item removed from cart'
+    return summary, 200
+
+
+@customer_bp.route('/customer/api/cart/clear', methods=['POST'])
+def clear_cart_json():
+    if 'customer_id' not in session:
+        return {'error': 'Please log in first'}, 401
+    
+    delete_cart()
+    
+    summary = _cart_summary({})
+    summary['message'] = 'Cart cleared'
+    return summary, 200
+
+
+def check_discount_eligibility(customer_id, discount_code, cart, customer=None):
     """
-    Check if customer is eligible for a discount code.
-    Returns: (is_eligible: bool, message: str, discount_type: DiscountType or None, discount_amount: float)
+    Check if customer is eligible for a discount code (rules live in discounts.py).
+    Pass the already loaded customer to skip looking it up again.
+    Returns: (is_eligible: bool, message: str, discount_type: DiscountTypeInfo or None, discount_amount: float, code: DiscountCodeInfo or None)
     """
     if not customer_id or not discount_code:
-        return False, "Invalid request", None, 0
+        return False, "Invalid request", None, 0, None
     
-    code = DiscountCode.query.filter_by(code=discount_code.upper().strip()).first()
+    code = get_discount_code(discount_code)
     if not code:
-        return False, f"Discount code '{discount_code}' does not exist", None, 0
+        return False, f"Discount code '{discount_code}' does not exist", None, 0, None
     
-    discount_type = DiscountType.query.get(code.discount_type_id)
-    if not discount_type:
-        return False, "Discount type configuration error", None, 0
+    if code.rule is None:
+        return False, "Unknown discount type", None, 0, None
     
-    customer = Customer.query.get(customer_id)
+    if customer is None:
+        customer = Customer.query.get(customer_id)
     if not customer:
-        return False, "Customer not found", None, 0
-    
-    if discount_type.name == "One-Time Promo":
-        orders_with_this_code = (
-            db.session.query(Order)
-            .filter(
-                Order.customer_id == customer_id,
-                Order.discount_code_id == code.discount_code_id
-            )
-            .all() 
-        )
-        
-        if orders_with_this_code:
-            order_count = len(orders_with_this_code)
-            return False, f"This one-time discount code has already been used by you ({order_count} time(s)). Each customer can only use WELCOME20 once.", None, 0
-        
-        return True, f"One-Time Promo: {discount_type.percent}% off your order", discount_type, 0
+        return False, "Customer not found", None, 0, None
     
-    elif discount_type.name == "Birthday Discount":
-        if not customer.is_birthday_today():
-            return False, f"Birthday discount only works on your birthday ({customer.dob.strftime('%B %d')}). Come back then!", None, 0
-        
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        birthday_orders_today = (
-            db.session.query(Order)
-            .filter(
-                Order.customer_id == customer_id,
-                Order.discount_code_id == code.discount_code_id,
-                Order.time_stamp >= today_start,
-                Order.time_stamp <= today_end
-            )
-            .all()
-        )
-        
-        if birthday_orders_today:
-            return False, "You have already used your birthday discount today. Only one birthday discount per year!", None, 0
-        
-        if not cart:
-            return False, "Your cart is empty", None, 0
-        
-        cheapest_pizza_price = min(item['price'] for item in cart.values())
-        
-        return True, f" Happy Birthday! 1 FREE cheapest pizza (worth ${cheapest_pizza_price:.2f})", discount_type, cheapest_pizza_price
+    is_eligible, message, discount_amount = code.rule.check(customer, code, cart)
+    if not is_eligible:
+        return False, message, None, 0, None
     
-    elif discount_type.name == "Loyalty Reward":
-        cart_pizza_count = sum(item['quantity'] for item in cart.values())
-        
-        total_pizzas = customer.loyalty_pizza_count + cart_pizza_count
-        
-        if total_pizzas < 10:
-            pizzas_needed = 10 - customer.loyalty_pizza_count
-            return False, f"You need {pizzas_needed} more pizza(s) to unlock the loyalty discount. You currently have {customer.loyalty_pizza_count} pizzas in your loyalty count.", None, 0
-        
-        return True, f" Loyalty Reward: {discount_type.percent}% off! (You've earned this with {customer.loyalty_pizza_count} pizzas)", discount_type, 0
+    return True, message, code.discount_type, discount_amount, code
+
+
+def _discount_from_quote(token, customer, cart, discount_code):
+    """
+    Same result as check_discount_eligibility, taken from a signed quote made by validate_discount.
+    Returns None when there is no usable quote (missing, forged, expired, other cart/code) or the
+    rule's re-check fails, the caller then falls back to the full evaluation.
+    """
+    code = get_discount_code(discount_code)
+    quote = read_quote(token, customer.customer_id, cart, code)
+    if quote is None or code.rule is None:
+        return None
+    
+    if not code.rule.recheck(customer, code, cart):
+        return None
     
-    return False, "Unknown discount type", None, 0
+    return True, quote['message'], code.discount_type, quote['amount'], code
 
 
 @customer_bp.route('/customer/validate-discount', methods=['POST'])
@@ -702,7 +718,7 @@ def validate_discount():
         return {'valid': False, 'message': 'Please log in first'}, 401
     
     discount_code = request.json.get('discount_code', '').strip().upper()
-    cart = session.get('cart', {})
+    cart = load_cart()
     
     if not discount_code:
         return {'valid': False, 'message': 'Please enter a discount code'}, 400
@@ -712,7 +728,7 @@ def validate_discount():
     
     total_with_vat = sum(item['price'] * item['quantity'] for item in cart.values())
     
-    is_eligible, message, discount_type, birthday_discount_amount = check_discount_eligibility(
+    is_eligible, message, discount_type, birthday_discount_amount, code = check_discount_eligibility(
         session['customer_id'],
         discount_code,
         cart
@@ -744,7 +760,9 @@ def validate_discount():
         'new_total': round(new_total, 2),
         'new_subtotal': round(new_subtotal, 2),
         'new_vat': round(new_vat, 2),
-        'savings': round(discount_amount, 2)
+        'savings': round(discount_amount, 2),
+        # Checkout accepts this instead of evaluating the code again
+        'quote': make_quote(session['customer_id'], cart, code, birthday_discount_amount, message)
     }, 200
 
 
@@ -779,14 +797,7 @@ def dashboard():
     
     admin_username = session.get('admin_username', 'Admin')
     
-    stats = {
-        'customers': Customer.query.count(),
-        'pizzas': Pizza.query.count(),
-        'ingredients': Ingredient.query.count(),
-        'orders': Order.query.count(),
-        'delivery_people': DeliveryPerson.query.count(),  
-        'discount_codes': DiscountType.query.count() 
-    }
+    stats = get_dashboard_counts()
     
     recent_customers = Customer.query.order_by(Customer.customer_id.desc()).limit(5).all()
     
@@ -804,20 +815,82 @@ def logout():
 ####################################
 
 # ---------------------- CUSTOMER ADMIN -------------------------
+CUSTOMERS_PAGE_SIZE = 48
+
+def _prefix_pattern(value):
+    """LIKE pattern matching values that start with `value` (wildcards in it are escaped)"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+def _customer_search_filters(search, postal_code):
+    """Prefix search on email/first/last name and postal code, all backed by indexes (see models.Customer)"""
+    filters = []
+    if search:
+        term = search.lower()
+        pattern = _prefix_pattern(term)
+        matches = [
+            func.lower(Customer.email).like(pattern, escape='\\'),
+            func.lower(Customer.first_name).like(pattern, escape='\\'),
+            func.lower(Customer.last_name).like(pattern, escape='\\'),
+        ]
+        if ' ' in term:
+            first_name, last_name = term.split(None, 1)
+            matches.append(and_(
+                func.lower(Customer.first_name).like(_prefix_pattern(first_name), escape='\\'),
+                func.lower(Customer.last_name).like(_prefix_pattern(last_name), escape='\\')
+            ))
+        filters.append(or_(*matches))
+    if postal_code:
+        filters.append(Customer.postal_code.like(_prefix_pattern(postal_code), escape='\\'))
+    return filters
+
 @admin_bp.route('/admin/customers')
 def customers():
     if 'admin_id' not in session:
         return redirect(url_for('admin.admin_login'))
     
-    customers = Customer.query.order_by(Customer.customer_id.asc()).all()
+    search = request.args.get('q', '').strip()
+    postal_code = request.args.get('postal_code', '').strip()
+    after = request.args.get('after', type=int)
+    
+    query = Customer.query.filter(*_customer_search_filters(search, postal_code))
+    filtered_count = query.count() if (search or postal_code) else None
+    if after:
+        query = query.filter(Customer.customer_id > after)
+    customers = query.order_by(Customer.customer_id.asc()).limit(CUSTOMERS_PAGE_SIZE + 1).all()
+    
+    has_more = len(customers) > CUSTOMERS_PAGE_SIZE
+    customers = customers[:CUSTOMERS_PAGE_SIZE]
+    
+    # Orders per customer on this page, one grouped query
+    order_counts = dict(
+        db.session.query(Order.customer_id, func.count(Order.order_id))
+        .filter(Order.customer_id.in_([customer.customer_id for customer in customers]))
+        .group_by(Order.customer_id)
+        .all()
+    ) if customers else {}
+    
+    # Materialized counter and a cached aggregate, paging doesn't rescan Customer/Order
+    total_customers = get_dashboard_counts()['customers']
+    customers_with_orders = cached_report(
+        current_app, 'customers_with_orders', (),
+        lambda: db.session.query(func.count(func.distinct(Order.customer_id))).scalar()
+    ).value
     
     stats = {
-        'total_customers': len(customers),
-        'customers_with_orders': len([c for c in customers if hasattr(c, 'orders') and c.orders]),
-        'total_count': len(customers) 
+        'total_customers': total_customers,
+        'customers_with_orders': customers_with_orders,
+        'total_count': filtered_count if filtered_count is not None else total_customers
     }
     
-    return render_template("admin_customers.html", customers=customers, stats=stats)
+    return render_template("admin_customers.html",
+                         customers=customers,
+                         order_counts=order_counts,
+                         stats=stats,
+                         search=search,
+                         postal_code=postal_code,
+                         next_after=customers[-1].customer_id if has_more else None,
+                         is_first_page=not after)
 
 # --------------------PIZZA ADMIN-----------------------------------
 @admin_bp.route('/admin/pizzas')
@@ -836,6 +909,8 @@ def pizzas():
         Ingredient, pizza_ingredient.c.ingredient_id == Ingredient.ingredient_id
     ).order_by(pizza_ingredient.c.pizza_id, Ingredient.name).all()
     
+    prices = price_pizzas([pizza.pizza_id for pizza in pizzas])
+    
     ingredients_by_pizza = {}
     for pizza_id, ingredient_id, ingredient_name, is_vegetarian in pizza_ingredients_query:
         if pizza_id not in ingredients_by_pizza:
@@ -860,7 +935,7 @@ def pizzas():
         
         total_ingredient_cost = sum(float(ingredient.cost) for ingredient in pizza.ingredients) if pizza.ingredients else 0
         
-        dynamic_price = compute_pizza_price(pizza)
+        dynamic_price = prices[pizza.pizza_id]
         
         pizza_info = {
             'pizza_id': pizza.pizza_id,
@@ -889,6 +964,36 @@ def pizzas():
     
     return render_template("admin_pizzas.html", pizzas=pizza_data, stats=stats)
 
+# What-if repricing: simulate ingredient cost changes across the whole catalogue without saving them
+@admin_bp.route('/admin/pizzas/what-if', methods=['POST'])
+def what_if_pricing():
+    if 'admin_id' not in session:
+        return {'error': 'Please log in first'}, 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        cost_overrides = {int(ingredient_id): float(cost) for ingredient_id, cost in data.get('costs', {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return {'error': 'costs must map ingredient ids to numbers'}, 400
+    
+    if any(cost < 0 for cost in cost_overrides.values()):
+        return {'error': 'Ingredient costs cannot be negative'}, 400
+    
+    current_prices = price_pizzas()
+    new_prices = price_pizzas(cost_overrides=cost_overrides)
+    
+    return {
+        'pizzas': [
+            {
+                'pizza_id': pizza_id,
+                'current_price': current_prices[pizza_id],
+                'new_price': new_prices[pizza_id],
+                'difference': round(new_prices[pizza_id] - current_prices[pizza_id], 2)
+            }
+            for pizza_id in current_prices
+        ]
+    }, 200
+
 # ---------------------------------------------------------------------#
 
 #--------------------INGREDIENTS ADMIN ----------------------------------
@@ -960,19 +1065,59 @@ def discount_codes():
     return render_template("admin_discount_codes.html", discount_codes=discount_codes)
 
 #------------------------ORDERS ADMIN --------------------------------------
+ORDERS_PAGE_SIZE = 50
+
+def _order_cursor(order):
+    """Keyset cursor of an order, the page after it starts with the next older order"""
+    return f"{order.time_stamp.isoformat()}_{order.order_id}"
+
+def _parse_order_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        time_stamp, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(time_stamp), int(order_id)
+    except ValueError:
+        return None
+
 @admin_bp.route('/admin/orders')
 def orders():
     if 'admin_id' not in session:
         return redirect(url_for('admin.admin_login'))
     
-    orders = Order.query.order_by(Order.time_stamp.desc()).all()
+    # Kitchen display: starts empty and long-polls admin.order_feed for new orders
+    if request.args.get('view') == 'kitchen':
+        return render_template("admin_orders.html", orders=[], stats=None, kitchen=True)
     
-    order_data = []
-    total_revenue = 0
-    delivered_count = 0
+    before = _parse_order_cursor(request.args.get('before'))
     
+    # One page of orders, customers joined in and items + pizzas loaded in one extra query
+    query = (
+        Order.query
+        .options(
+            joinedload(Order.customer),
+            selectinload(Order.order_items).joinedload(OrderItem.pizza)
+        )
+        .filter(Order.time_stamp.isnot(None))
+    )
+    if before:
+        before_time, before_id = before
+        query = query.filter(or_(
+            Order.time_stamp < before_time,
+            and_(Order.time_stamp == before_time, Order.order_id < before_id)
+        ))
+    orders = (query
+              .order_by(Order.time_stamp.desc(), Order.order_id.desc())
+              .limit(ORDERS_PAGE_SIZE + 1)
+              .all())
+    
+    has_more = len(orders) > ORDERS_PAGE_SIZE
+    orders = orders[:ORDERS_PAGE_SIZE]
+    next_cursor = _order_cursor(orders[-1]) if has_more else None
+    
+    order_data = []
     for order in orders:
-        customer = Customer.query.get(order.customer_id) if order.customer_id else None
+        customer = order.customer
         
         if customer:
             customer_name = f"{customer.first_name} {customer.last_name}"
@@ -981,228 +1126,377 @@ def orders():
             customer_name = "Unknown Customer"
             customer_email = "No email"
         
-        pizza_items = []
-        if order.order_items:
-            for order_item in order.order_items:
-                pizza = Pizza.query.get(order_item.pizza_id) if order_item.pizza_id else None
-                if pizza:
-                    pizza_items.append({
-                        'name': pizza.name,
-                        'quantity': order_item.quantity
-                    })
+        pizza_items = [
+            {'name': order_item.pizza.name, 'quantity': order_item.quantity}
+            for order_item in order.order_items if order_item.pizza
+        ]
         
         if not pizza_items:
             pizza_items = [{'name': 'Pizza details not available', 'quantity': 1}]
         
-        order_amount = float(order.total_price) if order.total_price else 0
-        total_revenue += order_amount
-        
-        order_status = 'pending' 
-        
         order_info = {
             'order_id': order.order_id,
-            'order_date': order.time_stamp if order.time_stamp else datetime.now(),  
-            'total_amount': order_amount,  
-            'status': order_status,  
+            'order_date': order.time_stamp,  
+            'total_amount': float(order.total_price) if order.total_price else 0,  
+            'status': order.get_status(),  
             'customer_name': customer_name,
             'customer_email': customer_email,
             'pizza_items': pizza_items
         }
         order_data.append(order_info)
     
-    total_orders = len(order_data)
-    average_order = total_revenue / total_orders if total_orders > 0 else 0
+    # Totals over all orders in one aggregate query
+    totals = db.session.query(
+        func.count(Order.order_id),
+        func.coalesce(func.sum(Order.total_price), 0),
+        func.coalesce(func.avg(Order.total_price), 0),
+        func.coalesce(func.sum(db.case((Order.effective_status == 'delivered', 1), else_=0)), 0)
+    ).one()
     
     stats = {
-        'total_orders': total_orders,
-        'total_revenue': total_revenue,
-        'average_order': average_order,
-        'delivered_orders': 0  
+        'total_orders': totals[0],
+        'total_revenue': float(totals[1]),
+        'average_order': float(totals[2]),
+        'delivered_orders': totals[3]
     }
     
-    return render_template("admin_orders.html", orders=order_data, stats=stats)
+    return render_template("admin_orders.html", orders=order_data, stats=stats, next_cursor=next_cursor, is_first_page=before is None)
 
-#-------------------- ADMIN REPORTS ------------------------------------------------------------------------------------------
-@admin_bp.route('/admin/reports/undelivered')
-def undelivered_orders():
+ORDER_FEED_LIMIT = 100
+ORDER_FEED_MAX_WAIT_SECONDS = 30
+ORDER_FEED_RECHECK_SECONDS = 5  # orders placed on another worker are only seen by re-querying
+ORDER_FEED_LATE_COMMIT_SECONDS = 60  # how long a missing order id is asked for again
+ORDER_FEED_GAP_SCAN = 20  # ids below the cursor checked for orders that were still committing
+ORDER_FEED_MAX_GAPS = 50
+
+'''
+The feed cursor is "<last order id>" followed by ".<id>:<unix time>" for every lower id that was
+missing when the cursor moved past it. Checkout takes its order id at flush and commits a bit
+later, so ids can become visible out of order; missing ids are asked for again until they show up
+or ORDER_FEED_LATE_COMMIT_SECONDS pass (ids of rolled back checkouts never do).
+'''
+
+def _format_feed_cursor(after_order_id, gaps):
+    return '.'.join([str(after_order_id)] + [f"{order_id}:{int(seen_at)}" for order_id, seen_at in sorted(gaps.items())])
+
+def _parse_feed_cursor(cursor):
+    """(last order id, {missing order id: unix time it went missing}), None for a missing/invalid cursor"""
+    if not cursor:
+        return None
+    try:
+        after_order_id, *gaps = cursor.split('.')
+        return int(after_order_id), dict(map(int, gap.split(':')) for gap in gaps)
+    except ValueError:
+        return None
+
+def _missing_order_ids(low, high):
+    """Ids in (low, high] without a committed order"""
+    low = max(low, 0)
+    if high <= low:
+        return set()
+    present = db.session.query(Order.order_id).filter(Order.order_id > low, Order.order_id <= high).all()
+    return set(range(low + 1, high + 1)) - {order_id for (order_id,) in present}
+
+def _order_feed(after_order_id=None, gap_ids=()):
+    """Orders with order_id > after_order_id or in gap_ids (oldest first), or the open orders when there is no cursor yet"""
+    query = (
+        db.session.query(
+            Order.order_id,
+            Order.time_stamp,
+            Order.total_price,
+            Order.status.label('stored_status'),
+            Order.effective_status.label('status'),
+            Customer.first_name,
+            Customer.last_name
+        )
+        .join(Customer, Customer.customer_id == Order.customer_id)
+    )
+    if after_order_id is None:
+        query = query.filter(Order.status != 'delivered', Order.effective_status != 'delivered')
+    elif gap_ids:
+        query = query.filter(or_(Order.order_id > after_order_id, Order.order_id.in_(gap_ids)))
+    else:
+        query = query.filter(Order.order_id > after_order_id)
+    rows = query.order_by(Order.order_id.asc()).limit(ORDER_FEED_LIMIT).all()
+    
+    items = {}
+    if rows:
+        item_rows = (
+            db.session.query(OrderItem.order_id, Pizza.name, OrderItem.quantity)
+            .join(Pizza, Pizza.pizza_id == OrderItem.pizza_id)
+            .filter(OrderItem.order_id.in_([row.order_id for row in rows]))
+            .order_by(OrderItem.order_id, OrderItem.order_item_id)
+            .all()
+        )
+        for order_id, name, quantity in item_rows:
+            items.setdefault(order_id, []).append([name, quantity])
+    
+    orders = []
+    for row in rows:
+        # Unix times of the time-based transitions, the display moves the order on by itself
+        placed_at = row.time_stamp.replace(tzinfo=timezone.utc) if row.time_stamp else None
+        moves_on = placed_at is not None and row.stored_status != 'delivered'
+        orders.append({
+            'id': row.order_id,
+            'time': row.time_stamp.strftime('%Y-%m-%d %H:%M') if row.time_stamp else None,
+            'customer': f"{row.first_name} {row.last_name}",
+            'items': items.get(row.order_id, []),
+            'total': float(row.total_price),
+            'status': row.status,
+            'out_for_delivery_at': (placed_at + timedelta(minutes=OUT_FOR_DELIVERY_AFTER_MINUTES)).timestamp() if moves_on else None,
+            'delivered_at': (placed_at + timedelta(minutes=DELIVERED_AFTER_MINUTES)).timestamp() if moves_on else None
+        })
+    return orders
+
+# Incremental order feed: GET ?cursor=<cursor of the last response>&wait=<seconds to long-poll>
+@admin_bp.route('/admin/orders/feed')
+def order_feed():
     if 'admin_id' not in session:
-        return redirect(url_for('admin.admin_login'))
-    
-    undelivered = Order.query.filter(
-        Order.status.in_(['pending', 'preparing', 'out_for_delivery'])
-    ).order_by(Order.time_stamp.desc()).all()
+        return {'error': 'Please log in first'}, 401
+    
+    cursor = _parse_feed_cursor(request.args.get('cursor'))
+    wait = min(max(request.args.get('wait', 0, type=float), 0), ORDER_FEED_MAX_WAIT_SECONDS)
+    deadline = time.monotonic() + wait
+    now = time.time()
+    
+    if cursor is None:
+        # First call: the open orders, oldest first. When they don't all fit continue after the last
+        # one sent, else after the newest order so history is never replayed
+        newest_order_id = db.session.query(func.max(Order.order_id)).scalar() or 0
+        orders = _order_feed()
+        if len(orders) == ORDER_FEED_LIMIT:
+            return {'orders': orders, 'cursor': _format_feed_cursor(orders[-1]['id'], {}), 'now': now}, 200
+        after_order_id = max([newest_order_id] + [order['id'] for order in orders])
+        missing = _missing_order_ids(after_order_id - ORDER_FEED_GAP_SCAN, after_order_id)
+        return {'orders': orders, 'cursor': _format_feed_cursor(after_order_id, dict.fromkeys(missing, now)), 'now': now}, 200
+    
+    after_order_id, gaps = cursor
+    gaps = {order_id: seen_at for order_id, seen_at in gaps.items()
+            if order_id < after_order_id and now - seen_at < ORDER_FEED_LATE_COMMIT_SECONDS}
+    while True:
+        orders = _order_feed(after_order_id, sorted(gaps))
+        remaining = deadline - time.monotonic()
+        if orders or remaining <= 0:
+            break
+        db.session.close()  # don't hold a pooled connection while waiting
+        wait_for_new_orders(min(remaining, ORDER_FEED_RECHECK_SECONDS))
+    
+    # Ids skipped on the way to the new cursor are still committing (or rolled back), ask for them again
+    sent = {order['id'] for order in orders}
+    new_after_order_id = max([after_order_id] + list(sent))
+    gaps = {order_id: seen_at for order_id, seen_at in gaps.items() if order_id not in sent}
+    gaps.update((order_id, now) for order_id in range(max(after_order_id, new_after_order_id - ORDER_FEED_GAP_SCAN) + 1, new_after_order_id) if order_id not in sent)
+    gaps = dict(sorted(gaps.items())[-ORDER_FEED_MAX_GAPS:])
+    return {'orders': orders, 'cursor': _format_feed_cursor(new_after_order_id, gaps), 'now': now}, 200
+
+#-------------------- ADMIN REPORTS ------------------------------------------------------------------------------------------
+UNDELIVERED_PAGE_SIZE = 50
+
+def _undelivered_report(page):
+    # The stored status column lags behind until the sweeper runs, filter and count on the computed one
+    status = Order.effective_status
+    open_orders = (Order.status != 'delivered', status != 'delivered')
+
+    stats = db.session.query(
+        func.count(Order.order_id).label('total'),
+        func.coalesce(func.sum(db.case((status == 'out_for_delivery', 1), else_=0)), 0).label('out_for_delivery'),
+        func.count(Order.delivery_person_id).label('assigned')
+    ).filter(*open_orders).one()
+    pages = max((stats.total + UNDELIVERED_PAGE_SIZE - 1) // UNDELIVERED_PAGE_SIZE, 1)
+
+    undelivered = (
+        db.session.query(
+            Order.order_id,
+            Order.time_stamp,
+            Order.total_price,
+            status.label('status'),
+            Customer.first_name,
+            Customer.last_name,
+            Customer.address,
+            Customer.postal_code,
+            DeliveryPerson.name.label('delivery_person_name')
+        )
+        .join(Customer, Customer.customer_id == Order.customer_id)
+        .outerjoin(DeliveryPerson, DeliveryPerson.delivery_person_id == Order.delivery_person_id)
+        .filter(*open_orders)
+        .order_by(Order.time_stamp.desc(), Order.order_id.desc())
+        .limit(UNDELIVERED_PAGE_SIZE)
+        .offset((page - 1) * UNDELIVERED_PAGE_SIZE)
+        .all()
+    )
     
     report_data = []
     for order in undelivered:
-        customer = Customer.query.get(order.customer_id)
-        delivery_person = DeliveryPerson.query.get(order.delivery_person_id) if order.delivery_person_id else None
-        
         report_data.append({
             'order_id': order.order_id,
-            'customer_name': f"{customer.first_name} {customer.last_name}",
-            'customer_address': customer.address,
-            'customer_postal_code': customer.postal_code,
-            'status': order.get_status(),
+            'customer_name': f"{order.first_name} {order.last_name}",
+            'customer_address': order.address,
+            'customer_postal_code': order.postal_code,
+            'status': order.status,
             'order_time': order.time_stamp,
-            'delivery_person': delivery_person.name if delivery_person else 'Not assigned',
+            'delivery_person': order.delivery_person_name or 'Not assigned',
             'total': float(order.total_price)
         })
     
-    return render_template('admin_reports_undelivered.html', orders=report_data)
+    return {'orders': report_data, 'stats': stats, 'pages': pages}
 
-@admin_bp.route('/admin/reports/top-pizzas')
-def top_pizzas():
+@admin_bp.route('/admin/reports/undelivered')
+def undelivered_orders():
     if 'admin_id' not in session:
         return redirect(url_for('admin.admin_login'))
     
-    one_month_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    
-    top_pizzas_query = (
-        db.session.query(
-            Pizza.pizza_id,
-            Pizza.name,
-            func.sum(OrderItem.quantity).label('total_sold'),
-            func.count(func.distinct(Order.order_id)).label('order_count')
-        )
-        .join(OrderItem, OrderItem.pizza_id == Pizza.pizza_id)
-        .join(Order, Order.order_id == OrderItem.order_id)
-        .filter(Order.time_stamp >= one_month_ago)
-        .group_by(Pizza.pizza_id, Pizza.name)
-        .order_by(func.sum(OrderItem.quantity).desc())
-        .limit(3)
-        .all()
-    )
+    page = max(request.args.get('page', 1, type=int), 1)
+    report = cached_report(current_app, 'undelivered', (page,), lambda: _undelivered_report(page))
     
+    return render_template('admin_reports_undelivered.html', page=page, report_name='undelivered',
+                           computed_at=report.computed_at, **report.value)
+
+TOP_PIZZAS_WINDOWS = (7, 30, 90)
+TOP_PIZZAS_LIMITS = (3, 5, 10)
+
+def _top_pizzas_report(days, top):
+    # Reads PizzaDailySales (at most `days` rows per pizza), revenue is what was charged (unit_price)
     report_data = []
-    for pizza_id, name, total_sold, order_count in top_pizzas_query:
-        pizza = Pizza.query.get(pizza_id)
-        price = compute_pizza_price(pizza)  
-        revenue = float(total_sold) * price
-        
+    for pizza_id, name, total_sold, order_count, revenue in top_pizzas_report(days, top):
+        revenue = float(revenue or 0)
         report_data.append({
             'rank': len(report_data) + 1,
             'name': name,
             'total_sold': int(total_sold),
             'order_count': int(order_count),
-            'price': price,
+            'price': revenue / int(total_sold) if total_sold else 0,
             'revenue': revenue
         })
-    
-    return render_template('admin_reports_top_pizzas.html', pizzas=report_data)
-
+    return report_data
 
-@admin_bp.route('/admin/reports/earnings')
-def earnings_report():
+@admin_bp.route('/admin/reports/top-pizzas')
+def top_pizzas():
     if 'admin_id' not in session:
         return redirect(url_for('admin.admin_login'))
     
-    filter_type = request.args.get('filter', 'gender')
+    days = request.args.get('days', 30, type=int)
+    if days not in TOP_PIZZAS_WINDOWS:
+        days = 30
+    top = request.args.get('top', 3, type=int)
+    if top not in TOP_PIZZAS_LIMITS:
+        top = 3
     
-    if filter_type == 'gender':
-        gender_earnings = (
-            db.session.query(
-                Customer.gender,
-                func.count(Order.order_id).label('order_count'),
-                func.sum(Order.total_price).label('total_revenue')
-            )
-            .join(Order, Order.customer_id == Customer.customer_id)
-            .group_by(Customer.gender)
-            .all()
-        )
-        
-        report_data = []
-        for gender, order_count, total_revenue in gender_earnings:
-            report_data.append({
-                'category': gender.capitalize() if gender else 'Unknown',
-                'order_count': int(order_count),
-                'total_revenue': float(total_revenue) if total_revenue else 0,
-                'avg_order_value': float(total_revenue / order_count) if order_count > 0 else 0
-            })
+    report = cached_report(current_app, 'top_pizzas', (days, top), lambda: _top_pizzas_report(days, top))
     
-    # ===== BY AGE GROUP - SKIP FOR NOW (no date_of_birth yet) =====
-    elif filter_type == 'age':
-        from datetime import date as _date
-
-        customers_with_orders = (
-            db.session.query(
-                Customer.customer_id,
-                Customer.dob,
-                func.sum(Order.total_price).label('total_revenue'),
-                func.count(Order.order_id).label('order_count')
-            )
-            .join(Order, Order.customer_id == Customer.customer_id)
-            .filter(Customer.dob.isnot(None))
-            .group_by(Customer.customer_id, Customer.dob)
-            .all()
-        )
-
-        age_groups = {
-            '18-25': {'revenue': 0.0, 'orders': 0},
-            '26-35': {'revenue': 0.0, 'orders': 0},
-            '36-50': {'revenue': 0.0, 'orders': 0},
-            '51+':   {'revenue': 0.0, 'orders': 0}
-        }
-
-        today = date.today()
-        for customer_id, dob, revenue, orders in customers_with_orders:
-            if not dob:
-                continue
-            try:
-                age = today.year - dob.year - ((today.month, today.day) < (dob_date.month, dob_date.day))
-            except Exception:
-                continue
+    start_day = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    return render_template('admin_reports_top_pizzas.html', pizzas=report.value, days=days, top=top,
+                           windows=TOP_PIZZAS_WINDOWS, limits=TOP_PIZZAS_LIMITS, start=start_day.isoformat(),
+                           report_name='top_pizzas', computed_at=report.computed_at)
 
-            rev = float(revenue) if revenue else 0.0
-            ords = int(orders) if orders else 0
 
-            if 18 <= age <= 25:
-                bucket = '18-25'
-            elif 26 <= age <= 35:
-                bucket = '26-35'
-            elif 36 <= age <= 50:
-                bucket = '36-50'
-            else:
-                bucket = '51+'
+def _parse_day(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
 
-            age_groups[bucket]['revenue'] += rev
-            age_groups[bucket]['orders'] += ords
+def _earnings_row(category, order_count, total_revenue):
+    order_count = int(order_count or 0)
+    total_revenue = float(total_revenue) if total_revenue else 0
+    return {
+        'category': category,
+        'order_count': order_count,
+        'total_revenue': total_revenue,
+        'avg_order_value': total_revenue / order_count if order_count > 0 else 0
+    }
 
+def _earnings_report(filter_type, start_day, end_day):
+    # Read from the daily rollups (revenue_rollups.py), not from Order
+    if filter_type == 'gender':
         report_data = []
-        for age_range, data in age_groups.items():
-            report_data.append({
-                'category': age_range,
-                'order_count': data['orders'],
-                'total_revenue': data['revenue'],
-                'avg_order_value': (data['revenue'] / data['orders']) if data['orders'] > 0 else 0
-            })
+        for gender, order_count, total_revenue in revenue_report('gender', start_day, end_day):
+            report_data.append(_earnings_row(gender.capitalize() if gender else 'Unknown', order_count, total_revenue))
     
-    elif filter_type == 'postal_code':
-        postal_earnings = (
-            db.session.query(
-                Customer.postal_code,
-                func.count(Order.order_id).label('order_count'),
-                func.sum(Order.total_price).label('total_revenue')
-            )
-            .join(Order, Order.customer_id == Customer.customer_id)
-            .filter(Customer.postal_code.isnot(None))  
-            .group_by(Customer.postal_code)
-            .order_by(func.sum(Order.total_price).desc())
-            .limit(20)  
-            .all()
-        )
+    elif filter_type == 'age':
+        by_bucket = {bucket: (order_count, total_revenue) for bucket, order_count, total_revenue in revenue_report('age_bucket', start_day, end_day)}
         
         report_data = []
-        for postal_code, order_count, total_revenue in postal_earnings:
-            report_data.append({
-                'category': f'Postal Code {postal_code}',
-                'order_count': int(order_count),
-                'total_revenue': float(total_revenue) if total_revenue else 0,
-                'avg_order_value': float(total_revenue / order_count) if order_count > 0 else 0
-            })
+        for age_range in AGE_BUCKETS:
+            order_count, total_revenue = by_bucket.get(age_range, (0, 0))
+            report_data.append(_earnings_row(age_range, order_count, total_revenue))
+    
+    elif filter_type == 'postal_code':
+        report_data = []
+        for postal_code, order_count, total_revenue in revenue_report('postal_code', start_day, end_day, limit=20, skip_unknown=True):
+            report_data.append(_earnings_row(f'Postal Code {postal_code}', order_count, total_revenue))
     
     else:
         report_data = []
     
+    return report_data
+
+@admin_bp.route('/admin/reports/earnings')
+def earnings_report():
+    if 'admin_id' not in session:
+        return redirect(url_for('admin.admin_login'))
+    
+    filter_type = request.args.get('filter', 'gender')
+    start_day = _parse_day(request.args.get('start'))
+    end_day = _parse_day(request.args.get('end'))
+    report = cached_report(current_app, 'earnings', (filter_type, start_day, end_day),
+                           lambda: _earnings_report(filter_type, start_day, end_day))
+
     return render_template('admin_reports_earnings.html', 
-                         report_data=report_data, 
-                         filter_type=filter_type)
+                         report_data=report.value, 
+                         filter_type=filter_type,
+                         start=start_day.isoformat() if start_day else '',
+                         end=end_day.isoformat() if end_day else '',
+                         report_name='earnings',
+                         computed_at=report.computed_at)
+
+CACHED_REPORTS = {
+    'undelivered': 'admin.undelivered_orders',
+    'top_pizzas': 'admin.top_pizzas',
+    'earnings': 'admin.earnings_report'
+}
+
+# "Refresh now" on a report page, drops the cached results so the redirect recomputes them
+@admin_bp.route('/admin/reports/<report>/refresh', methods=['POST'])
+def refresh_report(report):
+    if 'admin_id' not in session:
+        return redirect(url_for('admin.admin_login'))
+    if report not in CACHED_REPORTS:
+        abort(404)
+    
+    report_cache.invalidate(report)
+    
+    next_url = request.form.get('next', '')
+    if not next_url.startswith('/admin/reports/'):
+        next_url = url_for(CACHED_REPORTS[report])
+    return redirect(next_url)
+
+# Streaming exports (exports.py), ?start=YYYY-MM-DD&end=YYYY-MM-DD limits orders and reports to a date range
+@admin_bp.route('/admin/export/<dataset>.<any(csv, ndjson):export_format>')
+def export(dataset, export_format):
+    if 'admin_id' not in session:
+        return redirect(url_for('admin.admin_login'))
+    
+    start_day = _parse_day(request.args.get('start'))
+    end_day = _parse_day(request.args.get('end'))
+    
+    if dataset == 'orders':
+        chunks = export_orders(export_format, start_day, end_day)
+    elif dataset == 'customers':
+        chunks = export_customers(export_format)
+    elif dataset == 'undelivered':
+        chunks = export_undelivered(export_format, start_day, end_day)
+    elif dataset == 'earnings':
+        segment = request.args.get('segment', 'gender')
+        if segment not in EARNINGS_SEGMENTS:
+            abort(404)
+        chunks = export_earnings(export_format, segment, start_day, end_day)
+    elif dataset == 'top-pizzas':
+        chunks = export_pizza_sales(export_format, start_day, end_day)
+    else:
+        abort(404)
+    
+    # stream_with_context keeps the session (and its server-side cursor) open while the body is written
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{dataset}.{export_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
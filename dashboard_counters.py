@@ -0,0 +1,139 @@
+from sqlalchemy import event, update, insert, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, object_session
+from models import db, DashboardCounter, DashboardCounterDelta, Customer, Pizza, Ingredient, Order, DeliveryPerson, DiscountType
+from datetime import datetime, timezone
+
+'''
+Materialized row counts for the admin dashboard.
+after_insert/after_delete mapper hooks collect +1/-1 per counter while a flush runs, after_flush
+appends them to DashboardCounterDelta in the same transaction (so a rollback undoes them too).
+Writers only ever INSERT there, so concurrent checkouts never wait on a shared counter row;
+fold_dashboard_counter_deltas() (a scheduler job) adds the deltas to DashboardCounter and the
+dashboard reads counter + pending deltas.
+Bulk/Core inserts and deletes don't fire mapper hooks, reconcile_dashboard_counters() (a
+scheduler job) recounts everything now and then to fix any drift.
+'''
+
+COUNTED_MODELS = {
+    'customers': Customer,
+    'pizzas': Pizza,
+    'ingredients': Ingredient,
+    'orders': Order,
+    'delivery_people': DeliveryPerson,
+    'discount_codes': DiscountType,
+}
+
+
+def _upsert_counters(values, now):
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}[dialect]
+    statement = dialect_insert(DashboardCounter)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DashboardCounter.name],
+        set_={'value': statement.excluded.value, 'reconciled_at': statement.excluded.reconciled_at}
+    )
+    db.session.execute(statement, [
+        {'name': name, 'value': value, 'reconciled_at': now} for name, value in sorted(values.items())
+    ])
+
+
+def reconcile_dashboard_counters():
+    """
+    Recounts every table and overwrites the counters, returns the counts.
+    The pending deltas stay where they are and the counter is set to recount - pending, both read by
+    the same statement so a checkout committing meanwhile is either in both or in neither. The
+    counter rows are locked first, a fold running at the same time waits instead of adding deltas
+    the recount already saw.
+    """
+    db.session.execute(db.select(DashboardCounter.name).order_by(DashboardCounter.name).with_for_update()).all()
+    row = db.session.query(*[
+        column
+        for name, model in COUNTED_MODELS.items()
+        for column in (
+            db.select(db.func.count()).select_from(model).scalar_subquery().label(name),
+            db.select(db.func.coalesce(db.func.sum(DashboardCounterDelta.delta), 0))
+            .where(DashboardCounterDelta.name == name)
+            .scalar_subquery().label(f'{name}_pending')
+        )
+    ]).one()._asdict()
+
+    counts = {name: row[name] for name in COUNTED_MODELS}
+    _upsert_counters({name: counts[name] - row[f'{name}_pending'] for name in COUNTED_MODELS}, datetime.now(timezone.utc))
+    db.session.commit()
+    return counts
+
+
+def fold_dashboard_counter_deltas():
+    """
+    Scheduler job. Moves the pending deltas into DashboardCounter, returns how many were folded.
+    DELETE ... RETURNING claims the rows, so two workers folding at once never add a delta twice.
+    """
+    claimed = db.session.execute(
+        delete(DashboardCounterDelta).returning(DashboardCounterDelta.name, DashboardCounterDelta.delta)
+    ).all()
+    totals = {}
+    for name, delta in claimed:
+        totals[name] = totals.get(name, 0) + delta
+
+    for name, delta in sorted(totals.items()):
+        if delta:
+            db.session.execute(
+                update(DashboardCounter)
+                .where(DashboardCounter.name == name)
+                .values(value=DashboardCounter.value + delta)
+            )
+    db.session.commit()
+    return len(claimed)
+
+
+def get_dashboard_counts():
+    """{counter name: count} including the deltas not folded yet, one query, missing counters are created by a reconcile"""
+    pending = (
+        db.select(DashboardCounterDelta.name, db.func.sum(DashboardCounterDelta.delta).label('delta'))
+        .group_by(DashboardCounterDelta.name)
+        .subquery()
+    )
+    counts = dict(
+        db.session.query(DashboardCounter.name, DashboardCounter.value + db.func.coalesce(pending.c.delta, 0))
+        .outerjoin(pending, pending.c.name == DashboardCounter.name)
+        .all()
+    )
+    if any(name not in counts for name in COUNTED_MODELS):
+        return reconcile_dashboard_counters()
+    return counts
+
+
+#-------------------------Hooks------------------------------------------------------------
+_COUNTER_BY_MODEL = {model: name for name, model in COUNTED_MODELS.items()}
+
+
+def _track(delta):
+    def listener(mapper, connection, target):
+        session = object_session(target)
+        if session is None:
+            return
+        deltas = session.info.setdefault('dashboard_counter_deltas', {})
+        name = _COUNTER_BY_MODEL[type(target)]
+        deltas[name] = deltas.get(name, 0) + delta
+    return listener
+
+
+for _model in COUNTED_MODELS.values():
+    event.listen(_model, 'after_insert', _track(1))
+    event.listen(_model, 'after_delete', _track(-1))
+
+
+@event.listens_for(Session, 'after_flush')
+def _append_counter_deltas(session, flush_context):
+    deltas = session.info.pop('dashboard_counter_deltas', None)
+    if not deltas:
+        return
+    rows = [{'name': name, 'delta': delta} for name, delta in sorted(deltas.items()) if delta]
+    if rows:
+        session.connection().execute(insert(DashboardCounterDelta.__table__), rows)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_on_rollback(session, previous_transaction):
+    session.info.pop('dashboard_counter_deltas', None)
@@ -0,0 +1,240 @@
+from sqlalchemy import exists, func
+from models import db, Order, DiscountCode, DiscountType
+from commit_hooks import flag_on_commit, ChangeProbe, aggregate_fingerprint, text_digest
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from datetime import datetime
+import hashlib
+import json
+import threading
+
+'''
+In-memory discount rule registry.
+Discount codes and types are loaded once (one joined query) and kept until a DiscountCode or
+DiscountType change is committed, or a ChangeProbe sees one made elsewhere. Every discount type maps to a rule object that knows how to
+check eligibility, usage checks are EXISTS queries instead of loading the customer's orders.
+'''
+
+DISCOUNT_TABLES = ('DiscountCode', 'DiscountType')
+
+_lock = threading.Lock()
+_discounts_version = 0
+_codes = {}
+_codes_version = -1
+
+
+class DiscountTypeInfo:
+    __slots__ = ('discount_type_id', 'name', 'percent')
+
+    def __init__(self, discount_type_id, name, percent):
+        self.discount_type_id = discount_type_id
+        self.name = name
+        self.percent = percent
+
+
+class DiscountCodeInfo:
+    __slots__ = ('discount_code_id', 'code', 'discount_type', 'rule')
+
+    def __init__(self, discount_code_id, code, discount_type, rule):
+        self.discount_code_id = discount_code_id
+        self.code = code
+        self.discount_type = discount_type
+        self.rule = rule
+
+
+#-------------------------Rules------------------------------------------------------------
+class DiscountRule:
+    """
+    check() is the full evaluation and returns (is_eligible, message, discount_amount).
+    recheck() is the cheap "is a quote from a few minutes ago still good" test used at checkout.
+    """
+
+    def check(self, customer, code, cart):
+        raise NotImplementedError
+
+    def recheck(self, customer, code, cart):
+        return self.check(customer, code, cart)[0]
+
+
+def _code_used_by(customer, code, since=None, until=None):
+    conditions = [
+        Order.customer_id == customer.customer_id,
+        Order.discount_code_id == code.discount_code_id
+    ]
+    if since is not None:
+        conditions.append(Order.time_stamp >= since)
+    if until is not None:
+        conditions.append(Order.time_stamp <= until)
+    return db.session.query(exists().where(*conditions)).scalar()
+
+
+class OneTimePromoRule(DiscountRule):
+    def check(self, customer, code, cart):
+        if _code_used_by(customer, code):
+            return False, f"This one-time discount code has already been used by you. Each customer can only use {code.code} once.", 0
+
+        return True, f"One-Time Promo: {code.discount_type.percent}% off your order", 0
+
+
+class BirthdayDiscountRule(DiscountRule):
+    def check(self, customer, code, cart):
+        if not customer.is_birthday_today():
+            return False, f"Birthday discount only works on your birthday ({customer.dob.strftime('%B %d')}). Come back then!", 0
+
+        if self._used_today(customer, code):
+            return False, "You have already used your birthday discount today. Only one birthday discount per year!", 0
+
+        if not cart:
+            return False, "Your cart is empty", 0
+
+        cheapest_pizza_price = min(item['price'] for item in cart.values())
+
+        return True, f" Happy Birthday! 1 FREE cheapest pizza (worth ${cheapest_pizza_price:.2f})", cheapest_pizza_price
+
+    def recheck(self, customer, code, cart):
+        # The free pizza amount is in the quote, only the date and usage can have changed
+        return customer.is_birthday_today() and not self._used_today(customer, code)
+
+    def _used_today(self, customer, code):
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = datetime.now().replace(hour=23, minute=59, second=59, microsecond=999999)
+        return _code_used_by(customer, code, today_start, today_end)
+
+
+class LoyaltyRewardRule(DiscountRule):
+    PIZZAS_NEEDED = 10
+
+    def check(self, customer, code, cart):
+        cart_pizza_count = sum(item['quantity'] for item in cart.values())
+
+        total_pizzas = customer.loyalty_pizza_count + cart_pizza_count
+
+        if total_pizzas < self.PIZZAS_NEEDED:
+            pizzas_needed = self.PIZZAS_NEEDED - customer.loyalty_pizza_count
+            return False, f"You need {pizzas_needed} more pizza(s) to unlock the loyalty discount. You currently have {customer.loyalty_pizza_count} pizzas in your loyalty count.", 0
+
+        return True, f" Loyalty Reward: {code.discount_type.percent}% off! (You've earned this with {customer.loyalty_pizza_count} pizzas)", 0
+
+
+RULES_BY_TYPE_NAME = {
+    "One-Time Promo": OneTimePromoRule(),
+    "Birthday Discount": BirthdayDiscountRule(),
+    "Loyalty Reward": LoyaltyRewardRule(),
+}
+
+
+#-------------------------Signed quotes------------------------------------------------------------
+'''
+validate_discount hands out a signed, short-lived quote for (customer, cart, code, amount).
+Checkout trusts the amount in a valid quote and only runs rule.recheck(), without a (valid)
+quote it falls back to the full check.
+'''
+
+QUOTE_SALT = 'discount-quote'
+DEFAULT_QUOTE_TTL_SECONDS = 10 * 60
+
+
+def cart_hash(cart):
+    return hashlib.sha256(json.dumps(cart, sort_keys=True).encode()).hexdigest()
+
+
+def _quote_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt=QUOTE_SALT)
+
+
+def make_quote(customer_id, cart, code, discount_amount, message):
+    return _quote_serializer().dumps({
+        'customer_id': customer_id,
+        'cart': cart_hash(cart),
+        'code_id': code.discount_code_id,
+        'amount': discount_amount,
+        'message': message
+    })
+
+
+def read_quote(token, customer_id, cart, code):
+    """The quote payload if the token is authentic, not expired and made for this customer/cart/code, else None"""
+    if not token or code is None:
+        return None
+
+    max_age = current_app.config.get('DISCOUNT_QUOTE_TTL_SECONDS', DEFAULT_QUOTE_TTL_SECONDS)
+    try:
+        quote = _quote_serializer().loads(token, max_age=max_age)
+    except BadSignature:  # also covers SignatureExpired
+        return None
+
+    if (quote.get('customer_id') != customer_id
+            or quote.get('cart') != cart_hash(cart)
+            or quote.get('code_id') != code.discount_code_id):
+        return None
+    return quote
+
+
+#-------------------------Registry------------------------------------------------------------
+def invalidate_discounts():
+    global _discounts_version
+    with _lock:
+        _discounts_version += 1
+
+
+def _code_rows():
+    return (
+        db.session.query(
+            DiscountCode.discount_code_id,
+            DiscountCode.code,
+            DiscountType.discount_type_id,
+            DiscountType.name,
+            DiscountType.percent
+        )
+        .join(DiscountType, DiscountType.discount_type_id == DiscountCode.discount_type_id)
+        .order_by(DiscountCode.discount_code_id)
+        .all()
+    )
+
+
+def _discount_fingerprint():
+    return aggregate_fingerprint(
+        func.count(DiscountCode.discount_code_id),
+        func.max(DiscountCode.discount_code_id),
+        func.sum(DiscountCode.discount_code_id * DiscountCode.discount_type_id),
+        text_digest(DiscountCode.code, DiscountCode.discount_code_id),
+        func.count(DiscountType.discount_type_id),
+        func.max(DiscountType.discount_type_id),
+        func.sum(DiscountType.discount_type_id * DiscountType.percent),
+        text_digest(DiscountType.name, DiscountType.discount_type_id)
+    )
+
+
+def _load_codes():
+    codes = {}
+    for discount_code_id, code, discount_type_id, name, percent in _code_rows():
+        discount_type = DiscountTypeInfo(discount_type_id, name, percent)
+        codes[code.upper()] = DiscountCodeInfo(discount_code_id, code, discount_type, RULES_BY_TYPE_NAME.get(name))
+    return codes
+
+
+def get_discount_codes():
+    """{CODE: DiscountCodeInfo}, reloaded after a discount code/type change"""
+    global _codes, _codes_version
+    _probe.check()
+    version = _discounts_version
+    if _codes_version == version:
+        return _codes
+
+    codes = _load_codes()
+    with _lock:
+        if _discounts_version == version:
+            _codes = codes
+            _codes_version = version
+    return codes
+
+
+def get_discount_code(code):
+    return get_discount_codes().get(code.upper().strip())
+
+
+#-------------------------Invalidation hooks------------------------------------------------------------
+flag_on_commit(invalidate_discounts, models=(DiscountCode, DiscountType), tables=DISCOUNT_TABLES)
+
+# Discount edits made by another worker or straight in the database
+_probe = ChangeProbe(_discount_fingerprint, invalidate_discounts)
@@ -0,0 +1,348 @@
+from sqlalchemy import update, case, func, values, column, Integer
+from models import db, DeliveryPerson, DeliveryPersonPostalRange, Order, Customer
+from commit_hooks import flag_on_commit, ChangeProbe, aggregate_fingerprint
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+
+'''
+Delivery person allocator.
+Every step of the fallback chain is one query that takes the least recently assigned driver
+(ties broken by id, so the result is deterministic) and locks that row with
+SELECT ... FOR UPDATE SKIP LOCKED (the cooldown override, the last step, waits for the lock
+instead). The lock is held until the checkout transaction commits, so two concurrent checkouts
+can never pick the same driver.
+Which drivers cover a zip is answered by an in-memory interval tree over
+delivery_person_postal_range (rebuilt when the ranges change, here or elsewhere), the database is only used
+for the final lock-and-assign step.
+
+With DISPATCH_MODE=batch checkout leaves the driver empty and run_batch_dispatch() (a scheduler
+job) matches all pending orders to free drivers at once.
+'''
+
+COOLDOWN = timedelta(minutes=30)
+
+STEP_POSTAL_RANGE = 'postal_range'   # covers the zip and is off cooldown
+STEP_ANY_AVAILABLE = 'any_available' # any driver off cooldown
+STEP_COOLDOWN_OVERRIDE = 'cooldown_override' # everybody is busy, take the one waiting the longest
+
+
+class Allocation:
+    __slots__ = ('delivery_person', 'step', 'queries', 'elapsed_ms')
+
+    def __init__(self, delivery_person, step, queries, elapsed_ms):
+        self.delivery_person = delivery_person
+        self.step = step
+        self.queries = queries
+        self.elapsed_ms = elapsed_ms
+
+
+def _parse_zip(postal_code):
+    try:
+        return int(str(postal_code).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _off_cooldown(now):
+    threshold = now - COOLDOWN
+    return (DeliveryPerson.last_assigned_at.is_(None)) | (DeliveryPerson.last_assigned_at <= threshold)
+
+
+#-------------------------Postal range index------------------------------------------------------------
+class _IntervalNode:
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, intervals):
+        endpoints = sorted(point for start, end, _ in intervals for point in (start, end))
+        self.center = endpoints[len(endpoints) // 2]
+
+        here, left, right = [], [], []
+        for interval in intervals:
+            start, end, _ = interval
+            if end < self.center:
+                left.append(interval)
+            elif start > self.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+
+        self.by_start = sorted(here, key=lambda interval: interval[0])
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = _IntervalNode(left) if left else None
+        self.right = _IntervalNode(right) if right else None
+
+
+class PostalRangeIndex:
+    """Centered interval tree over (start_zip, end_zip, delivery_person_id), stabbing queries in O(log n + k)"""
+
+    def __init__(self, ranges):
+        self.size = len(ranges)
+        self._root = _IntervalNode(list(ranges)) if ranges else None
+
+    def covering(self, zip_code):
+        """Ids of the drivers with a range containing zip_code"""
+        found = set()
+        node = self._root
+        while node is not None:
+            if zip_code < node.center:
+                for start, _, delivery_person_id in node.by_start:
+                    if start > zip_code:
+                        break
+                    found.add(delivery_person_id)
+                node = node.left
+            elif zip_code > node.center:
+                for _, end, delivery_person_id in node.by_end:
+                    if end < zip_code:
+                        break
+                    found.add(delivery_person_id)
+                node = node.right
+            else:
+                found.update(delivery_person_id for _, _, delivery_person_id in node.by_start)
+                break
+        return found
+
+
+_lock = threading.Lock()
+_ranges_version = 0
+_index = None
+_index_version = -1
+
+
+def invalidate_postal_index():
+    global _ranges_version
+    with _lock:
+        _ranges_version += 1
+
+
+def _range_rows():
+    return [tuple(row) for row in db.session.query(
+        DeliveryPersonPostalRange.start_zip,
+        DeliveryPersonPostalRange.end_zip,
+        DeliveryPersonPostalRange.delivery_person_id
+    ).order_by(
+        DeliveryPersonPostalRange.delivery_person_id,
+        DeliveryPersonPostalRange.start_zip,
+        DeliveryPersonPostalRange.end_zip
+    ).all()]
+
+
+def _ranges_fingerprint():
+    ranges = DeliveryPersonPostalRange
+    return aggregate_fingerprint(
+        func.count(ranges.delivery_person_id),
+        func.max(ranges.delivery_person_id),
+        func.sum(ranges.start_zip),
+        func.sum(ranges.end_zip - ranges.start_zip),
+        func.sum(ranges.delivery_person_id * ranges.start_zip)  # a range handed to another driver
+    )
+
+
+def get_postal_index():
+    global _index, _index_version
+    _probe.check()
+    version = _ranges_version
+    if _index_version == version:
+        return _index
+
+    index = PostalRangeIndex(_range_rows())
+
+    with _lock:
+        if _ranges_version == version:
+            _index = index
+            _index_version = version
+    return index
+
+
+#-------------------------Allocation------------------------------------------------------------
+def _lock_least_recently_assigned(*conditions, skip_locked=True):
+    return (DeliveryPerson.query
+            .filter(*conditions)
+            .order_by(DeliveryPerson.last_assigned_at.asc().nullsfirst(), DeliveryPerson.delivery_person_id.asc())
+            .limit(1)
+            .with_for_update(skip_locked=skip_locked)
+            .first())
+
+
+def allocate_delivery_person(postal_code, now=None):
+    """
+    Picks and locks a driver for the postal code. The caller sets last_assigned_at and commits.
+    Returns an Allocation (delivery_person is None when there are no drivers at all).
+    """
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    zip_code = _parse_zip(postal_code)
+
+    chain = []
+    if zip_code is not None:
+        eligible_ids = get_postal_index().covering(zip_code)
+        if eligible_ids:
+            chain.append((STEP_POSTAL_RANGE, (DeliveryPerson.delivery_person_id.in_(eligible_ids), _off_cooldown(now))))
+    chain.append((STEP_ANY_AVAILABLE, (_off_cooldown(now),)))
+    chain.append((STEP_COOLDOWN_OVERRIDE, ()))
+
+    queries = 0
+    for step, conditions in chain:
+        queries += 1
+        # The last resort waits for a locked driver instead of skipping it: with every driver held by an
+        # in-flight checkout SKIP LOCKED would find nobody, and in inline mode nothing assigns the order later
+        dp = _lock_least_recently_assigned(*conditions, skip_locked=(step != STEP_COOLDOWN_OVERRIDE))
+        if dp:
+            return Allocation(dp, step, queries, (time.perf_counter() - started) * 1000)
+
+    return Allocation(None, None, queries, (time.perf_counter() - started) * 1000)
+
+
+#-------------------------Batch dispatch------------------------------------------------------------
+BATCH_SIZE = 200
+MAX_WAIT_FOR_LOCAL_DRIVER = timedelta(minutes=2) # after this an order takes any free driver
+DELIVERY_WINDOW = timedelta(minutes=30) # older orders count as delivered (see Order.get_status)
+
+
+def _match(order_ids, candidates):
+    """
+    Maximum bipartite matching of orders to drivers (Kuhn's augmenting paths).
+    candidates[order_id] lists the eligible drivers, least recently assigned first, orders are
+    tried oldest first so they win ties. Returns {order_id: delivery_person_id}.
+    """
+    driver_to_order = {}
+
+    def try_assign(order_id, seen):
+        for delivery_person_id in candidates.get(order_id, ()):
+            if delivery_person_id in seen:
+                continue
+            seen.add(delivery_person_id)
+            current = driver_to_order.get(delivery_person_id)
+            if current is None or try_assign(current, seen):
+                driver_to_order[delivery_person_id] = order_id
+                return True
+        return False
+
+    for order_id in order_ids:
+        try_assign(order_id, set())
+
+    return {order_id: delivery_person_id for delivery_person_id, order_id in driver_to_order.items()}
+
+
+def _write_assignments(assignments, now):
+    """
+    {order_id: delivery_person_id} -> one UPDATE on Postgres: the pairs as a VALUES CTE, the drivers
+    stamped by a data-modifying CTE and the orders updated FROM the pairs.
+    SQLite (local dev) has no UPDATE inside WITH, it runs the orders CASE update and the drivers one apart.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        assigned = db.select(
+            values(column('order_id', Integer), column('delivery_person_id', Integer), name='assignment')
+            .data(list(assignments.items()))
+        ).cte('assigned')
+        stamped = (
+            update(DeliveryPerson)
+            .where(DeliveryPerson.delivery_person_id == assigned.c.delivery_person_id)
+            .values(last_assigned_at=now)
+            .cte('stamped_drivers')
+        )
+        db.session.execute(
+            update(Order)
+            .where(Order.order_id == assigned.c.order_id)
+            .values(delivery_person_id=assigned.c.delivery_person_id)
+            .add_cte(stamped)
+            .execution_options(synchronize_session=False)
+        )
+        return
+
+    db.session.execute(
+        update(Order)
+        .where(Order.order_id.in_(assignments.keys()))
+        .values(delivery_person_id=case(assignments, value=Order.order_id))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(DeliveryPerson)
+        .where(DeliveryPerson.delivery_person_id.in_(assignments.values()))
+        .values(last_assigned_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def run_batch_dispatch(now=None):
+    """
+    Assigns drivers to every pending order in one go, respecting postal ranges and the cooldown.
+    Orders and drivers are locked with SKIP LOCKED so several workers can run this concurrently.
+    Returns the number of orders that got a driver.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+
+    pending = (
+        db.session.query(Order.order_id, Order.time_stamp, Customer.postal_code)
+        .join(Customer, Customer.customer_id == Order.customer_id)
+        .filter(
+            Order.delivery_person_id.is_(None),
+            Order.status != 'delivered',
+            Order.time_stamp >= now - DELIVERY_WINDOW
+        )
+        .order_by(Order.time_stamp.asc(), Order.order_id.asc())
+        .limit(BATCH_SIZE)
+        .with_for_update(of=Order, skip_locked=True)
+        .all()
+    )
+    if not pending:
+        db.session.rollback()
+        return 0
+
+    free_drivers = [
+        delivery_person_id for (delivery_person_id,) in
+        db.session.query(DeliveryPerson.delivery_person_id)
+        .filter(_off_cooldown(now))
+        .order_by(DeliveryPerson.last_assigned_at.asc().nullsfirst(), DeliveryPerson.delivery_person_id.asc())
+        .with_for_update(skip_locked=True)
+        .all()
+    ]
+    if not free_drivers:
+        db.session.rollback()
+        return 0
+
+    index = get_postal_index()
+    order_ids = [order_id for order_id, _, _ in pending]
+    candidates = {}
+    for order_id, _, postal_code in pending:
+        zip_code = _parse_zip(postal_code)
+        covering = index.covering(zip_code) if zip_code is not None else set()
+        candidates[order_id] = [d for d in free_drivers if d in covering]
+
+    assignments = _match(order_ids, candidates)
+
+    # Orders nobody local could take for a while get whichever driver is still free
+    still_free = [d for d in free_drivers if d not in set(assignments.values())]
+    for order_id, time_stamp, _ in pending:
+        if not still_free:
+            break
+        if order_id in assignments:
+            continue
+        waited = now - time_stamp.replace(tzinfo=timezone.utc)
+        if waited >= MAX_WAIT_FOR_LOCAL_DRIVER:
+            assignments[order_id] = still_free.pop(0)
+
+    if not assignments:
+        db.session.rollback()
+        return 0
+
+    _write_assignments(assignments, now)
+    db.session.commit()
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"🚚 Batch dispatch: {len(assignments)}/{len(pending)} pending orders assigned in {elapsed_ms:.1f} ms")
+    return len(assignments)
+
+
+#-------------------------Invalidation hooks------------------------------------------------------------
+flag_on_commit(
+    invalidate_postal_index,
+    models=(DeliveryPersonPostalRange,),
+    deleted_models=(DeliveryPerson,),
+    tables=('delivery_person_postal_range',),
+    deleted_tables=('DeliveryPerson',)
+)
+
+# Range edits made by another worker or straight in the database
+_probe = ChangeProbe(_ranges_fingerprint, invalidate_postal_index)
@@ -0,0 +1,178 @@
+from models import db, Order, OrderItem, Customer, Pizza, DeliveryPerson
+from revenue_rollups import revenue_report, pizza_sales_report
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from itertools import groupby
+import csv
+import json
+
+'''
+Streaming admin exports (CSV / NDJSON).
+Every export is a generator over a column-only SELECT run with yield_per, so rows come from a
+server-side cursor (a named cursor on psycopg2) EXPORT_BATCH_SIZE at a time and nothing lands in
+the session's identity map. The response is written while the rows are read, memory stays flat
+whatever the number of rows. The report exports read the rollups and are small anyway.
+'''
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+ORDER_COLUMNS = ('order_id', 'time_stamp', 'status', 'customer_id', 'customer_email', 'delivery_person_id',
+                 'discount_code_id', 'total_price')
+ORDER_ITEM_COLUMNS = ('pizza_id', 'pizza_name', 'quantity', 'unit_price')
+CUSTOMER_COLUMNS = ('customer_id', 'first_name', 'last_name', 'email', 'telephone', 'address', 'postal_code',
+                    'gender', 'dob', 'loyalty_pizza_count')
+UNDELIVERED_COLUMNS = ('order_id', 'time_stamp', 'status', 'first_name', 'last_name', 'address', 'postal_code',
+                       'delivery_person', 'total_price')
+EARNINGS_SEGMENTS = ('gender', 'age_bucket', 'postal_code')
+PIZZA_SALES_COLUMNS = ('pizza_id', 'pizza_name', 'quantity', 'order_count', 'revenue')
+
+
+class _Line:
+    """csv.writer target that hands back the formatted line instead of writing it"""
+
+    def write(self, line):
+        return line
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)  # keep the exact amount
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, default=_json_default) + '\n'
+
+
+def _chunked(lines):
+    """Joins the lines into one chunk per EXPORT_BATCH_SIZE rows, fewer and bigger writes to the socket"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= EXPORT_BATCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _stream(statement):
+    return db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+
+def _rows(columns, rows, export_format):
+    if export_format == 'csv':
+        return _chunked(_csv_lines(columns, rows))
+    return _chunked(_ndjson_lines(dict(zip(columns, row)) for row in rows))
+
+
+def _in_range(column, start_day, end_day):
+    conditions = []
+    if start_day:
+        conditions.append(column >= datetime.combine(start_day, datetime.min.time()))
+    if end_day:
+        conditions.append(column < datetime.combine(end_day + timedelta(days=1), datetime.min.time()))
+    return conditions
+
+
+#-------------------------Exports------------------------------------------------------------
+def export_orders(export_format, start_day=None, end_day=None):
+    """
+    Orders placed in [start_day, end_day] with their items. CSV has one line per item (the order
+    columns repeated), NDJSON one object per order with an `items` list.
+    """
+    statement = (
+        db.select(
+            Order.order_id,
+            Order.time_stamp,
+            Order.effective_status,
+            Order.customer_id,
+            Customer.email,
+            Order.delivery_person_id,
+            Order.discount_code_id,
+            Order.total_price,
+            OrderItem.pizza_id,
+            Pizza.name,
+            OrderItem.quantity,
+            OrderItem.unit_price
+        )
+        .join(Customer, Customer.customer_id == Order.customer_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.order_id)
+        .outerjoin(Pizza, Pizza.pizza_id == OrderItem.pizza_id)
+        .where(*_in_range(Order.time_stamp, start_day, end_day))
+        .order_by(Order.time_stamp, Order.order_id, OrderItem.pizza_id)
+    )
+    rows = _stream(statement)
+
+    if export_format == 'csv':
+        return _chunked(_csv_lines(ORDER_COLUMNS + ORDER_ITEM_COLUMNS, rows))
+
+    order_width = len(ORDER_COLUMNS)
+
+    def orders():
+        # Rows come sorted by order, so an order's items are consecutive
+        for _, lines in groupby(rows, key=lambda row: row[0]):
+            lines = list(lines)
+            order = dict(zip(ORDER_COLUMNS, lines[0][:order_width]))
+            order['items'] = [
+                dict(zip(ORDER_ITEM_COLUMNS, line[order_width:]))
+                for line in lines if line[order_width] is not None
+            ]
+            yield order
+
+    return _chunked(_ndjson_lines(orders()))
+
+
+def export_customers(export_format):
+    statement = (
+        db.select(*(getattr(Customer, column) for column in CUSTOMER_COLUMNS))
+        .order_by(Customer.customer_id)
+    )
+    return _rows(CUSTOMER_COLUMNS, _stream(statement), export_format)
+
+
+def export_undelivered(export_format, start_day=None, end_day=None):
+    status = Order.effective_status
+    statement = (
+        db.select(
+            Order.order_id,
+            Order.time_stamp,
+            status,
+            Customer.first_name,
+            Customer.last_name,
+            Customer.address,
+            Customer.postal_code,
+            DeliveryPerson.name,
+            Order.total_price
+        )
+        .join(Customer, Customer.customer_id == Order.customer_id)
+        .outerjoin(DeliveryPerson, DeliveryPerson.delivery_person_id == Order.delivery_person_id)
+        .where(Order.status != 'delivered', status != 'delivered', *_in_range(Order.time_stamp, start_day, end_day))
+        .order_by(Order.time_stamp, Order.order_id)
+    )
+    return _rows(UNDELIVERED_COLUMNS, _stream(statement), export_format)
+
+
+def export_earnings(export_format, segment, start_day=None, end_day=None):
+    """revenue_report() rows, `segment` is one of EARNINGS_SEGMENTS"""
+    rows = revenue_report(segment, start_day, end_day)
+    return _rows((segment, 'order_count', 'revenue'), rows, export_format)
+
+
+def export_pizza_sales(export_format, start_day=None, end_day=None):
+    rows = pizza_sales_report(start_day, end_day)
+    return _rows(PIZZA_SALES_COLUMNS, rows, export_format)
@@ -0,0 +1,18 @@
+import os
+
+'''
+gunicorn settings, read from the working directory: `gunicorn "app:create_app()"`.
+gevent workers keep idle SSE streams and long-polls as greenlets. psycopg2 is a C driver that
+monkey-patching doesn't reach, post_fork installs psycogreen's wait callback so a query yields
+to the other greenlets instead of blocking the whole worker.
+With more than one worker set CART_STORE=sqlite, the in-memory cart store is per process.
+'''
+
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
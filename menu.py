@@ -0,0 +1,303 @@
+from sqlalchemy import func, inspect, case
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from models import db, Pizza, Ingredient, pizza_ingredient
+from commit_hooks import flag_on_commit, ChangeProbe, aggregate_fingerprint, text_digest
+import numpy as np
+import threading
+import uuid
+
+'''
+Process-wide menu price cache and the customer menu read model.
+A pizza price only depends on the cost of its ingredients, so prices only change when
+an Ingredient.cost changes or when pizza_ingredient links are added/removed.
+All prices are computed at once from a pizza x ingredient matrix and kept under a menu version, the commit
+hook at the bottom of this file bumps the version when such a change is committed.
+'''
+
+MARGIN = 1.40
+VAT = 1.09
+
+MENU_TABLES = ('Pizza', 'Ingredient', 'pizza_ingredient')
+
+_lock = threading.Lock()
+_menu_version = 0
+# Versions are per process, the token keeps two workers from handing out the same ETag for different menus
+_process_token = uuid.uuid4().hex[:8]
+_matrix = None
+_prices = {}
+_prices_version = -1
+_menu_rows = {'version': -1, 'rows': [], 'by_id': {}}
+
+
+def get_menu_version():
+    _probe.check()
+    return _menu_version
+
+
+def get_menu_etag_base():
+    _probe.check()
+    return f"{_process_token}-{_menu_version}"
+
+
+def invalidate_menu():
+    """Bump the menu version, the next price lookup rebuilds the cache"""
+    global _menu_version
+    with _lock:
+        _menu_version += 1
+
+
+#-------------------------Bulk pricing------------------------------------------------------------
+class PriceMatrix:
+    """
+    Sparse pizza x ingredient incidence matrix (one (row, col) pair per pizza_ingredient link)
+    plus the ingredient cost vector. Pricing the whole catalogue is a single sparse
+    matrix-vector product.
+    """
+    __slots__ = ('pizza_ids', 'ingredient_ids', 'rows', 'cols', 'costs')
+
+    def __init__(self, pizza_ids, ingredient_ids, rows, cols, costs):
+        self.pizza_ids = pizza_ids
+        self.ingredient_ids = ingredient_ids
+        self.rows = rows
+        self.cols = cols
+        self.costs = costs
+
+    def cost_vector(self, cost_overrides=None):
+        """Ingredient costs, optionally with some of them replaced by {ingredient_id: cost}"""
+        if not cost_overrides:
+            return self.costs
+        costs = self.costs.copy()
+        for position, ingredient_id in enumerate(self.ingredient_ids):
+            if ingredient_id in cost_overrides:
+                costs[position] = float(cost_overrides[ingredient_id])
+        return costs
+
+    def base_costs(self, cost_overrides=None):
+        costs = self.cost_vector(cost_overrides)
+        return np.bincount(self.rows, weights=costs[self.cols], minlength=len(self.pizza_ids))
+
+    def prices(self, cost_overrides=None):
+        raw_prices = self.base_costs(cost_overrides) * MARGIN * VAT
+        # Python's round() so prices match the per-pizza Python sum to the cent
+        return {pizza_id: round(price, 1) for pizza_id, price in zip(self.pizza_ids, raw_prices.tolist())}
+
+
+def _load_price_matrix():
+    links = (
+        db.session.query(Pizza.pizza_id, pizza_ingredient.c.ingredient_id)
+        .outerjoin(pizza_ingredient, pizza_ingredient.c.pizza_id == Pizza.pizza_id)
+        .order_by(Pizza.pizza_id)
+        .all()
+    )
+    ingredients = db.session.query(Ingredient.ingredient_id, Ingredient.cost).order_by(Ingredient.ingredient_id).all()
+
+    ingredient_ids = [ingredient_id for ingredient_id, _ in ingredients]
+    ingredient_index = {ingredient_id: position for position, ingredient_id in enumerate(ingredient_ids)}
+    costs = np.array([float(cost) for _, cost in ingredients], dtype=np.float64)
+
+    pizza_ids = []
+    pizza_index = {}
+    rows = []
+    cols = []
+    for pizza_id, ingredient_id in links:
+        if pizza_id not in pizza_index:
+            pizza_index[pizza_id] = len(pizza_ids)
+            pizza_ids.append(pizza_id)
+        if ingredient_id is not None:
+            rows.append(pizza_index[pizza_id])
+            cols.append(ingredient_index[ingredient_id])
+
+    return PriceMatrix(pizza_ids, ingredient_ids,
+                       np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp), costs)
+
+
+def _refresh():
+    global _matrix, _prices, _prices_version
+    version = _menu_version
+    matrix = _load_price_matrix()
+    prices = matrix.prices()
+    with _lock:
+        # Only publish if nobody invalidated the menu while we were loading
+        if _menu_version == version:
+            _matrix = matrix
+            _prices = prices
+            _prices_version = version
+    return matrix, prices
+
+
+def get_price_matrix():
+    _probe.check()
+    if _prices_version == _menu_version:
+        return _matrix
+    return _refresh()[0]
+
+
+def get_menu_prices():
+    """Returns {pizza_id: price} for the whole menu, rebuilt when the menu changed"""
+    _probe.check()
+    if _prices_version == _menu_version:
+        return _prices
+    return _refresh()[1]
+
+
+def get_pizza_price(pizza_id):
+    return get_menu_prices().get(pizza_id, 0.0)
+
+
+def price_pizzas(pizza_ids=None, cost_overrides=None):
+    """
+    Bulk pricing API. Returns {pizza_id: price} for the given pizzas (all pizzas when None).
+    cost_overrides={ingredient_id: cost} prices the catalogue as if those costs were in place,
+    without touching the database (what-if repricing).
+    """
+    if cost_overrides:
+        prices = get_price_matrix().prices(cost_overrides)
+    else:
+        prices = get_menu_prices()
+
+    if pizza_ids is None:
+        return dict(prices)
+    return {pizza_id: prices.get(pizza_id, 0.0) for pizza_id in pizza_ids}
+
+
+#-------------------------Menu read model------------------------------------------------------------
+class MenuRow:
+    """One pizza as the customer menu shows it"""
+    __slots__ = ('pizza_id', 'name', 'price', 'is_vegetarian', 'ingredient_names', 'ingredient_count', 'ingredients_text')
+
+    def __init__(self, pizza_id, name, price, is_vegetarian, ingredient_names):
+        self.pizza_id = pizza_id
+        self.name = name
+        self.price = price
+        self.is_vegetarian = bool(is_vegetarian)
+        self.ingredient_names = ingredient_names
+        self.ingredient_count = len(ingredient_names)
+
+        if not ingredient_names:
+            self.ingredients_text = 'Delicious pizza with premium ingredients'
+        elif len(ingredient_names) <= 3:
+            self.ingredients_text = ', '.join(ingredient_names)
+        else:
+            self.ingredients_text = ', '.join(ingredient_names[:3]) + ' and more...'
+
+
+NAME_SEPARATOR = '\x1f'
+
+
+def _ingredient_names_column(dialect_name):
+    if dialect_name == 'postgresql':
+        return (func.array_agg(aggregate_order_by(Ingredient.name, Ingredient.name))
+                .filter(Ingredient.ingredient_id.isnot(None)))
+    # SQLite (local dev) has no array_agg, names come back joined and get sorted in Python
+    return func.group_concat(Ingredient.name, NAME_SEPARATOR)
+
+
+def _split_names(names):
+    if names is None:
+        return []
+    if isinstance(names, str):
+        return sorted(names.split(NAME_SEPARATOR))
+    return list(names)
+
+
+def load_menu():
+    """
+    The whole customer menu in one aggregate query: vegetarian flag (bool_and over the
+    ingredients, a pizza without ingredients counts as vegetarian), ordered ingredient names
+    and ingredient count per pizza. Prices come from the bulk pricer.
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    prices = price_pizzas()
+
+    rows = (
+        db.session.query(
+            Pizza.pizza_id,
+            Pizza.name,
+            func.min(case((Ingredient.vegetarian.is_(False), 0), else_=1)),
+            _ingredient_names_column(dialect_name)
+        )
+        .outerjoin(pizza_ingredient, pizza_ingredient.c.pizza_id == Pizza.pizza_id)
+        .outerjoin(Ingredient, Ingredient.ingredient_id == pizza_ingredient.c.ingredient_id)
+        .group_by(Pizza.pizza_id, Pizza.name)
+        .order_by(Pizza.pizza_id.asc())
+        .all()
+    )
+
+    return [MenuRow(pizza_id, name, prices.get(pizza_id, 0.0), is_vegetarian, _split_names(names))
+            for pizza_id, name, is_vegetarian, names in rows]
+
+
+def get_menu():
+    """load_menu(), cached per menu version"""
+    _probe.check()
+    version = _menu_version
+    if _menu_rows['version'] == version:
+        return _menu_rows['rows']
+
+    rows = load_menu()
+    with _lock:
+        if _menu_version == version:
+            _menu_rows.update(version=version, rows=rows, by_id={row.pizza_id: row for row in rows})
+    return rows
+
+
+def get_menu_row(pizza_id):
+    """The MenuRow of one pizza, or None if there is no such pizza"""
+    rows = get_menu()
+    if _menu_rows['rows'] is rows:
+        return _menu_rows['by_id'].get(pizza_id)
+    return next((row for row in rows if row.pizza_id == pizza_id), None)
+
+
+#-------------------------Invalidation hooks------------------------------------------------------------
+def _menu_changed_in(session):
+    for obj in session.new:
+        if isinstance(obj, Pizza):
+            return True
+        if isinstance(obj, Ingredient) and obj.pizzas:
+            return True
+
+    for obj in session.deleted:
+        if isinstance(obj, (Pizza, Ingredient)):
+            return True
+
+    for obj in session.dirty:
+        if isinstance(obj, Ingredient):
+            attrs = inspect(obj).attrs
+            if attrs.cost.history.has_changes() or attrs.pizzas.history.has_changes():
+                return True
+            # Names and veg flags don't move prices but they do change the rendered menu
+            if attrs.name.history.has_changes() or attrs.vegetarian.history.has_changes():
+                return True
+        elif isinstance(obj, Pizza):
+            attrs = inspect(obj).attrs
+            if attrs.ingredients.history.has_changes() or attrs.name.history.has_changes():
+                return True
+    return False
+
+
+# Covers Ingredient.query.update(...) and raw inserts/deletes on pizza_ingredient too
+flag_on_commit(invalidate_menu, models=(Pizza, Ingredient), tables=MENU_TABLES, changed=_menu_changed_in)
+
+
+def _menu_fingerprint():
+    """Everything the prices and the rendered menu depend on, as one row of aggregates"""
+    links = pizza_ingredient.c
+    return aggregate_fingerprint(
+        func.count(Pizza.pizza_id),
+        func.max(Pizza.pizza_id),
+        text_digest(Pizza.name, Pizza.pizza_id),
+        func.count(Ingredient.ingredient_id),
+        func.max(Ingredient.ingredient_id),
+        func.sum(Ingredient.cost),
+        func.sum(Ingredient.cost * Ingredient.ingredient_id),  # two costs swapped
+        func.sum(case((Ingredient.vegetarian.is_(True), Ingredient.ingredient_id), else_=0)),
+        text_digest(Ingredient.name, Ingredient.ingredient_id),
+        func.count(links.pizza_id),
+        func.sum(links.pizza_id * links.ingredient_id),
+        func.sum(links.pizza_id + links.ingredient_id)
+    )
+
+
+# Menu edits made by another worker or straight in the database
+_probe = ChangeProbe(_menu_fingerprint, invalidate_menu)
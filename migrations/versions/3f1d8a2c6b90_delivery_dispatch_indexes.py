@@ -0,0 +1,32 @@
+"""delivery dispatch indexes
+
+Revision ID: 3f1d8a2c6b90
+Revises: 9c621d1e0752
+Create Date: 2026-10-17 10:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1d8a2c6b90'
+down_revision = '9c621d1e0752'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('DeliveryPerson', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_DeliveryPerson_last_assigned_at'), ['last_assigned_at'], unique=False)
+
+    with op.batch_alter_table('delivery_person_postal_range', schema=None) as batch_op:
+        batch_op.create_index('ix_dppr_zip_range', ['start_zip', 'end_zip'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('delivery_person_postal_range', schema=None) as batch_op:
+        batch_op.drop_index('ix_dppr_zip_range')
+
+    with op.batch_alter_table('DeliveryPerson', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_DeliveryPerson_last_assigned_at'))
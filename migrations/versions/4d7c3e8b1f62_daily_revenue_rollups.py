@@ -0,0 +1,33 @@
+"""daily revenue rollups
+
+Revision ID: 4d7c3e8b1f62
+Revises: e2a9b6f4d381
+Create Date: 2026-10-17 11:41:26.083714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d7c3e8b1f62'
+down_revision = 'e2a9b6f4d381'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by the revenue_rollups_catch_up job (first run backfills the history)
+    op.create_table('DailyRevenue',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('gender', sa.String(length=10), nullable=False),
+    sa.Column('age_bucket', sa.String(length=10), nullable=False),
+    sa.Column('postal_code', sa.String(length=10), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'gender', 'age_bucket', 'postal_code')
+    )
+
+
+def downgrade():
+    op.drop_table('DailyRevenue')
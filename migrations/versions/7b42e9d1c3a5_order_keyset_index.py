@@ -0,0 +1,26 @@
+"""order keyset index
+
+Revision ID: 7b42e9d1c3a5
+Revises: 3f1d8a2c6b90
+Create Date: 2026-10-17 10:31:08.552910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b42e9d1c3a5'
+down_revision = '3f1d8a2c6b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Order', schema=None) as batch_op:
+        batch_op.create_index('ix_order_time_stamp_order_id', ['time_stamp', 'order_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_time_stamp_order_id')
@@ -0,0 +1,33 @@
+"""pizza daily sales
+
+Revision ID: a6e1f3c94b28
+Revises: 4d7c3e8b1f62
+Create Date: 2026-10-17 13:02:47.512903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e1f3c94b28'
+down_revision = '4d7c3e8b1f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by the revenue_rollups_catch_up job (first run backfills the history)
+    op.create_table('PizzaDailySales',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('pizza_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('revenue', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['pizza_id'], ['Pizza.pizza_id'], ),
+    sa.PrimaryKeyConstraint('day', 'pizza_id')
+    )
+
+
+def downgrade():
+    op.drop_table('PizzaDailySales')
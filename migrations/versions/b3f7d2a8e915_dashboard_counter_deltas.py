@@ -0,0 +1,30 @@
+"""dashboard counter deltas
+
+Revision ID: b3f7d2a8e915
+Revises: a6e1f3c94b28
+Create Date: 2026-10-17 14:05:12.408127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f7d2a8e915'
+down_revision = 'a6e1f3c94b28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Appended to by writers, folded into DashboardCounter by the dashboard_counters_fold job
+    op.create_table('DashboardCounterDelta',
+    sa.Column('delta_id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('delta', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('delta_id')
+    )
+
+
+def downgrade():
+    op.drop_table('DashboardCounterDelta')
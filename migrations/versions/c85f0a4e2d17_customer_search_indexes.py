@@ -0,0 +1,42 @@
+"""customer search indexes
+
+Revision ID: c85f0a4e2d17
+Revises: 7b42e9d1c3a5
+Create Date: 2026-10-17 10:52:19.304127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c85f0a4e2d17'
+down_revision = '7b42e9d1c3a5'
+branch_labels = None
+depends_on = None
+
+
+# Prefix searches are lower(col) LIKE 'abc%', Postgres only uses a btree for that with text_pattern_ops
+SEARCH_INDEXES = [
+    ('ix_customer_lower_email', 'lower(email)'),
+    ('ix_customer_lower_first_name', 'lower(first_name)'),
+    ('ix_customer_lower_last_name', 'lower(last_name)'),
+    ('ix_customer_postal_code', 'postal_code'),
+]
+
+
+def upgrade():
+    ops = ' text_pattern_ops' if op.get_bind().dialect.name == 'postgresql' else ''
+    for name, expression in SEARCH_INDEXES:
+        op.create_index(name, 'Customer', [sa.text(expression + ops)], unique=False)
+
+    with op.batch_alter_table('Order', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_Order_customer_id'), ['customer_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Order', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Order_customer_id'))
+
+    for name, _ in reversed(SEARCH_INDEXES):
+        op.drop_index(name, table_name='Customer')
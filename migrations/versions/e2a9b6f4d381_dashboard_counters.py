@@ -0,0 +1,48 @@
+"""dashboard counters
+
+Revision ID: e2a9b6f4d381
+Revises: c85f0a4e2d17
+Create Date: 2026-10-17 11:14:47.620385
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a9b6f4d381'
+down_revision = 'c85f0a4e2d17'
+branch_labels = None
+depends_on = None
+
+
+COUNTED_TABLES = {
+    'customers': 'Customer',
+    'pizzas': 'Pizza',
+    'ingredients': 'Ingredient',
+    'orders': 'Order',
+    'delivery_people': 'DeliveryPerson',
+    'discount_codes': 'DiscountType',
+}
+
+
+def upgrade():
+    op.create_table('DashboardCounter',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.Column('reconciled_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Start from the real counts, the hooks keep them up to date from here on
+    op.execute(
+        'INSERT INTO "DashboardCounter" (name, value, reconciled_at) '
+        + ' UNION ALL '.join(
+            f'SELECT \'{name}\', COUNT(*), CURRENT_TIMESTAMP FROM "{table}"'
+            for name, table in COUNTED_TABLES.items()
+        )
+    )
+
+
+def downgrade():
+    op.drop_table('DashboardCounter')
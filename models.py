@@ -3,6 +3,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone, date
 from sqlalchemy import SmallInteger, Column
+from sqlalchemy.ext.hybrid import hybrid_property
 import os
 
 load_dotenv()
@@ -55,6 +56,16 @@ class Customer(db.Model):
     def __repr__(self):
         return f"<CustomerID {self.customer_id} First Name {self.first_name} address {self.address}>"
 
+# Prefix search of admin.customers (lower(col) LIKE 'abc%'), text_pattern_ops so Postgres can use them for LIKE
+db.Index('ix_customer_lower_email', db.func.lower(Customer.email).label('lower_email'),
+         postgresql_ops={'lower_email': 'text_pattern_ops'})
+db.Index('ix_customer_lower_first_name', db.func.lower(Customer.first_name).label('lower_first_name'),
+         postgresql_ops={'lower_first_name': 'text_pattern_ops'})
+db.Index('ix_customer_lower_last_name', db.func.lower(Customer.last_name).label('lower_last_name'),
+         postgresql_ops={'lower_last_name': 'text_pattern_ops'})
+db.Index('ix_customer_postal_code', Customer.postal_code,
+         postgresql_ops={'postal_code': 'text_pattern_ops'})
+
 class DiscountCode(db.Model):
     __tablename__="DiscountCode"
     discount_code_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -114,12 +125,39 @@ class OrderItem(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(7,2), nullable=False)
 
+    pizza = db.relationship("Pizza")
+
+# Time-based order status: preparing -> out_for_delivery -> delivered
+OUT_FOR_DELIVERY_AFTER_MINUTES = 10
+DELIVERED_AFTER_MINUTES = 30
+
+def order_status(status, time_stamp, now=None):
+    """Time-based status of an order from its stored status and time stamp"""
+    if status == 'delivered':
+        return 'delivered'
+    
+    if not time_stamp:
+        return 'pending'
+    
+    elapsed = (now or datetime.now(timezone.utc)) - time_stamp.replace(tzinfo=timezone.utc)
+    minutes = elapsed.total_seconds() / 60
+    
+    if minutes < OUT_FOR_DELIVERY_AFTER_MINUTES:
+        return 'preparing'
+    elif minutes < DELIVERED_AFTER_MINUTES:
+        return 'out_for_delivery'
+    else:
+        return 'delivered'
+
 #order is connected to every other table too, how to deal with that? 
 class Order(db.Model):
     __tablename__ = "Order"
+    __table_args__ = (
+        db.Index('ix_order_time_stamp_order_id', 'time_stamp', 'order_id'),  # keyset pagination of admin.orders
+    )
     order_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     discount_code_id = db.Column(db.Integer, db.ForeignKey("DiscountCode.discount_code_id"), nullable=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey("Customer.customer_id"), nullable=False)
+    customer_id = db.Column(db.Integer, db.ForeignKey("Customer.customer_id"), nullable=False, index=True)
     delivery_person_id = db.Column(db.Integer, db.ForeignKey("DeliveryPerson.delivery_person_id"))  # Enforces one-to-one relationship
     total_price = db.Column(db.Numeric(7,2), nullable=False)
     time_stamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -128,36 +166,75 @@ class Order(db.Model):
 
     order_items = db.relationship("OrderItem", backref="order", lazy=True)
     delivery_person = db.relationship("DeliveryPerson", backref=db.backref("orders", lazy=True))
+    customer = db.relationship("Customer")
 
     def get_status(self): 
-        """Auto-calculate status based on elapsed time"""
-        if self.status == 'delivered':
-            return 'delivered'
-        
-        if not self.time_stamp:
-            return 'pending'
-        
-        elapsed = datetime.now(timezone.utc) - self.time_stamp.replace(tzinfo=timezone.utc)
-        minutes = elapsed.total_seconds() / 60
-        
-        if minutes < 10:
-            return 'preparing'
-        elif minutes < 30:
-            return 'out_for_delivery'
-        else:
-            # Auto-mark as delivered after 30 minutes
-            self.status = 'delivered'
-            if not self.delivered_at:
-                self.delivered_at = self.time_stamp + timedelta(minutes=30)
-            db.session.commit()
-            return 'delivered'
-        
+        """Auto-calculate status based on elapsed time (read-only, sweep_order_statuses persists it)"""
+        return order_status(self.status, self.time_stamp)
+
+    @classmethod
+    def status_at(cls, now=None):
+        """SQL CASE with the same rules as get_status(), evaluated against `now`"""
+        now = now or datetime.now(timezone.utc)
+        return db.case(
+            (cls.status == 'delivered', 'delivered'),
+            (cls.time_stamp.is_(None), 'pending'),
+            (cls.time_stamp > now - timedelta(minutes=OUT_FOR_DELIVERY_AFTER_MINUTES), 'preparing'),
+            (cls.time_stamp > now - timedelta(minutes=DELIVERED_AFTER_MINUTES), 'out_for_delivery'),
+            else_='delivered'
+        )
+
+    @hybrid_property
+    def effective_status(self):
+        """Time-based status, usable in queries: Order.query.filter(Order.effective_status != 'delivered')"""
+        return self.get_status()
+
+    @effective_status.inplace.expression
+    @classmethod
+    def _effective_status_expression(cls):
+        return cls.status_at()
+
+
+def sweep_order_statuses(now=None):
+    """
+    Background job: writes the time-based status of every open order in one set-based UPDATE,
+    so page reads never have to. Returns [(order_id, new_status)] for the orders that changed.
+    """
+    now = now or datetime.now(timezone.utc)
+    delivered_before = now - timedelta(minutes=DELIVERED_AFTER_MINUTES)
+    new_status = Order.status_at(now)
+
+    if db.session.get_bind().dialect.name == 'sqlite':
+        delivered_at = db.func.datetime(Order.time_stamp, f'+{DELIVERED_AFTER_MINUTES} minutes')
+    else:
+        delivered_at = Order.time_stamp + timedelta(minutes=DELIVERED_AFTER_MINUTES)
+
+    changed = db.session.execute(
+        db.update(Order)
+        .where(
+            Order.status != 'delivered',
+            Order.time_stamp.isnot(None),
+            Order.status != new_status
+        )
+        .values(
+            status=new_status,
+            delivered_at=db.case(
+                (Order.time_stamp <= delivered_before, db.func.coalesce(Order.delivered_at, delivered_at)),
+                else_=Order.delivered_at
+            )
+        )
+        .returning(Order.order_id, Order.status)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return [tuple(row) for row in changed]
+
 class DeliveryPerson(db.Model):
     __tablename__ = "DeliveryPerson"
     delivery_person_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(100), nullable=False)
     postal_code = db.Column(db.String(10))
-    last_assigned_at = db.Column(db.DateTime, nullable=True)  # NEW
+    last_assigned_at = db.Column(db.DateTime, nullable=True, index=True)  # index: dispatch takes the least recently assigned driver
 
     postal_ranges = db.relationship(
         "DeliveryPersonPostalRange",
@@ -178,6 +255,7 @@ class DeliveryPersonPostalRange(db.Model):
 
     __table_args__ = (
         db.CheckConstraint('start_zip <= end_zip', name='ck_dppr_bounds'),
+        db.Index('ix_dppr_zip_range', 'start_zip', 'end_zip'),
     )
 
     delivery_person = db.relationship("DeliveryPerson", back_populates="postal_ranges")
@@ -199,6 +277,39 @@ class Admin(db.Model):
 
     def __repr__(self):
         return f"<Admin {self.username}>"
+
+class DailyRevenue(db.Model):
+    """Orders and revenue per day and customer segment, maintained by revenue_rollups.py"""
+    __tablename__ = "DailyRevenue"
+    day = db.Column(db.Date, primary_key=True)
+    gender = db.Column(db.String(10), primary_key=True)
+    age_bucket = db.Column(db.String(10), primary_key=True)
+    postal_code = db.Column(db.String(10), primary_key=True)  # '' when the customer has none
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12,2), nullable=False, default=0)
+
+class PizzaDailySales(db.Model):
+    """Sales per pizza and day (quantity, distinct orders, revenue at unit_price), maintained by revenue_rollups.py"""
+    __tablename__ = "PizzaDailySales"
+    day = db.Column(db.Date, primary_key=True)
+    pizza_id = db.Column(db.Integer, db.ForeignKey("Pizza.pizza_id"), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12,2), nullable=False, default=0)
+
+class DashboardCounter(db.Model):
+    """Row counts for the admin dashboard, kept up to date by dashboard_counters.py"""
+    __tablename__ = "DashboardCounter"
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime, nullable=True)
+
+class DashboardCounterDelta(db.Model):
+    """+1/-1 per counted row written, appended by checkout & co. and folded into DashboardCounter by a job"""
+    __tablename__ = "DashboardCounterDelta"
+    delta_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(50), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
    ###
 
 def seed_data():
@@ -0,0 +1,174 @@
+from models import Order, order_status, sweep_order_statuses, OUT_FOR_DELIVERY_AFTER_MINUTES, DELIVERED_AFTER_MINUTES
+from commit_hooks import flag_on_commit
+from collections import deque
+from datetime import datetime, timedelta, timezone
+import json
+import threading
+import time
+
+'''
+Live order status for the customer pages (Server-Sent Events).
+OrderEventHub is an in-process pub/sub keyed by order id, the status sweeper publishes every
+transition it commits. A stream only waits on its own subscription (no polling, no database
+connection held while idle) and also wakes up at the order's next time-based transition, so it
+stays correct when another worker's sweeper did the update.
+Streams block on threading primitives, under gevent workers (gunicorn -k gevent) every idle stream
+is a parked greenlet instead of an OS thread.
+
+New orders also bump a counter (wait_for_new_orders), the admin order feed long-polls on it.
+'''
+
+HEARTBEAT_SECONDS = 15
+RETRY_MILLISECONDS = 5000
+MAX_STREAM_SECONDS = (DELIVERED_AFTER_MINUTES + 15) * 60
+
+
+class Subscription:
+    __slots__ = ('order_ids', '_events', '_ready')
+
+    def __init__(self, order_ids):
+        self.order_ids = frozenset(order_ids)
+        self._events = deque()
+        self._ready = threading.Event()
+
+    def push(self, event):
+        self._events.append(event)
+        self._ready.set()
+
+    def wait(self, timeout):
+        """Events published since the last call, waits up to `timeout` seconds for the first one"""
+        if not self._events:
+            self._ready.wait(timeout)
+        self._ready.clear()
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+
+class OrderEventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, order_ids):
+        subscription = Subscription(order_ids)
+        with self._lock:
+            for order_id in subscription.order_ids:
+                self._subscribers.setdefault(order_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for order_id in subscription.order_ids:
+                subscribers = self._subscribers.get(order_id)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[order_id]
+
+    def publish(self, order_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(order_id, ()))
+        for subscription in subscribers:
+            subscription.push(event)
+        return len(subscribers)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+hub = OrderEventHub()
+
+
+def publish_status(order_id, status):
+    return hub.publish(order_id, {'order_id': order_id, 'status': status})
+
+
+def sweep_and_publish():
+    """Scheduler job: persists the time-based statuses and pushes the transitions to open streams"""
+    changed = sweep_order_statuses()
+    for order_id, status in changed:
+        publish_status(order_id, status)
+    return len(changed)
+
+
+#-------------------------Streams------------------------------------------------------------
+def _next_transition(time_stamp, now):
+    """Seconds until the next time-based status change, None when there is none left"""
+    if not time_stamp:
+        return None
+    placed_at = time_stamp.replace(tzinfo=timezone.utc)
+    for minutes in (OUT_FOR_DELIVERY_AFTER_MINUTES, DELIVERED_AFTER_MINUTES):
+        seconds = (placed_at + timedelta(minutes=minutes) - now).total_seconds()
+        if seconds > 0:
+            return seconds
+    return None
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def status_stream(orders):
+    """
+    SSE generator for {order_id: (stored_status, time_stamp)}. Emits a `status` event whenever an
+    order's status changes (and once on connect) and ends when every order is delivered.
+    Must not touch the database or the Flask session, it runs after the request context is gone.
+    """
+    orders = dict(orders)
+    subscription = hub.subscribe(orders)
+    sent = {}
+    started = time.monotonic()
+    try:
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        while orders and time.monotonic() - started < MAX_STREAM_SECONDS:
+            now = datetime.now(timezone.utc)
+            for order_id, (stored_status, time_stamp) in list(orders.items()):
+                status = order_status(stored_status, time_stamp, now)
+                if sent.get(order_id) != status:
+                    sent[order_id] = status
+                    yield _sse('status', {'order_id': order_id, 'status': status})
+                if status == 'delivered':
+                    del orders[order_id]
+            if not orders:
+                break
+
+            timeout = HEARTBEAT_SECONDS
+            for _, time_stamp in orders.values():
+                seconds = _next_transition(time_stamp, now)
+                if seconds is not None:
+                    timeout = min(timeout, seconds + 0.5)
+
+            published = subscription.wait(timeout)
+            for update in published:
+                if update['order_id'] in orders:
+                    orders[update['order_id']] = (update['status'], orders[update['order_id']][1])
+            if not published:
+                yield ": keep-alive\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+
+#-------------------------New orders------------------------------------------------------------
+_new_orders = threading.Condition()
+_new_order_count = 0
+
+
+def notify_new_orders():
+    global _new_order_count
+    with _new_orders:
+        _new_order_count += 1
+        _new_orders.notify_all()
+
+
+def wait_for_new_orders(timeout):
+    """Blocks until an order is placed in this process or the timeout passes, True if one was"""
+    with _new_orders:
+        seen = _new_order_count
+        return _new_orders.wait_for(lambda: _new_order_count != seen, timeout)
+
+
+flag_on_commit(notify_new_orders, models=(Order,), changed=lambda session: any(isinstance(obj, Order) for obj in session.new))
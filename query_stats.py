@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import re
+import threading
+import time
+
+'''
+SQL statement counting/timing.
+count_queries() counts every statement this thread sends to the database while the block runs,
+so hot paths such as checkout can report how many round trips they cost.
+init_query_stats() does the same for every request: the totals go into a Server-Timing header and
+one log line per request, and statement shapes that repeat QUERY_STATS_N_PLUS_ONE_THRESHOLD times
+or more are reported as a likely N+1 (a query run once per row of a previous one).
+'''
+
+DEFAULT_N_PLUS_ONE_THRESHOLD = 10
+SHAPE_LOG_LENGTH = 160
+
+_local = threading.local()
+# IN (?, ?, ?) lists change length with the data, count them as one shape
+_in_list = re.compile(r"IN \((?:\s*(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)\s*,?)+\)")
+
+
+class QueryCounter:
+    __slots__ = ('count', 'elapsed_ms', 'shapes')
+
+    def __init__(self, track_shapes=False):
+        self.count = 0
+        self.elapsed_ms = 0.0
+        self.shapes = {} if track_shapes else None
+
+    def repeated(self, threshold):
+        """[(count, statement shape)] run at least `threshold` times, most repeated first"""
+        if not self.shapes:
+            return []
+        return sorted(((count, shape) for shape, count in self.shapes.items() if count >= threshold), reverse=True)
+
+
+def _active_counters():
+    counters = getattr(_local, 'counters', None)
+    if counters is None:
+        counters = _local.counters = []
+    return counters
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    counters = _active_counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def statement_shape(statement):
+    if 'IN (' in statement:
+        statement = _in_list.sub('IN (...)', statement)
+    return statement
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+    shape = None
+    for counter in _active_counters():
+        counter.count += 1
+        counter.elapsed_ms += elapsed_ms
+        if counter.shapes is not None:
+            if shape is None:
+                shape = statement_shape(statement)
+            counter.shapes[shape] = counter.shapes.get(shape, 0) + 1
+
+
+#-------------------------Per request------------------------------------------------------------
+def _start_request_stats():
+    counter = QueryCounter(track_shapes=True)
+    _active_counters().append(counter)
+    g.query_stats = counter
+    g.query_stats_started = time.perf_counter()
+
+
+def _server_timing(response):
+    counter = g.get('query_stats')
+    if counter is not None:
+        total_ms = (time.perf_counter() - g.query_stats_started) * 1000
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={counter.elapsed_ms:.1f};desc="{counter.count} queries", app;dur={total_ms:.1f}'
+        )
+    return response
+
+
+def _finish_request_stats(app, error):
+    # Runs after a streamed body is written, so queries made while streaming are included
+    counter = g.pop('query_stats', None)
+    if counter is None:
+        return
+    counters = _active_counters()
+    if counter in counters:
+        counters.remove(counter)
+
+    total_ms = (time.perf_counter() - g.pop('query_stats_started')) * 1000
+    threshold = app.config.get('QUERY_STATS_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD)
+    repeated = counter.repeated(threshold)
+    print(f"{request.method} {request.path}: {counter.count} queries ({counter.elapsed_ms:.1f} ms SQL) "
+          f"in {total_ms:.1f} ms" + (f", {len(repeated)} possible N+1" if repeated else ""))
+    for count, shape in repeated:
+        shape = ' '.join(shape.split())
+        print(f"⚠️ N+1 on {request.path}: {count}x {shape[:SHAPE_LOG_LENGTH]}")
+
+
+def init_query_stats(app):
+    """Per-request query counting, off with QUERY_STATS_ENABLED=False"""
+    if not app.config.get('QUERY_STATS_ENABLED', True):
+        return
+    app.before_request(_start_request_stats)
+    app.after_request(_server_timing)
+    app.teardown_request(lambda error: _finish_request_stats(app, error))
@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+import threading
+import time
+
+'''
+Process-wide TTL cache for the admin reports.
+Entries are keyed by (report, parameters...) and kept for the report's TTL (REPORT_CACHE_TTL_SECONDS).
+Misses are single-flight: the first request computes, concurrent requests for the same key wait
+for that result instead of running the same queries in parallel. invalidate() drops a report
+(the "Refresh now" button), the next request recomputes it. A computation that was already running
+when the report got invalidated still answers its own waiters but isn't stored (generation check,
+like the menu version in menu.py), and later requests don't join it.
+'''
+
+DEFAULT_TTL_SECONDS = 60
+
+
+class CachedReport:
+    __slots__ = ('value', 'computed_at', 'expires_at')
+
+    def __init__(self, value, computed_at, expires_at):
+        self.value = value
+        self.computed_at = computed_at
+        self.expires_at = expires_at
+
+
+class _Flight:
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # CachedReport, stays None when the computation failed
+
+
+class ReportCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+        self._generations = {}  # report -> bumped by every invalidate()
+
+    def get(self, key, ttl_seconds, compute):
+        """CachedReport for key, compute() runs at most once at a time per key"""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at > time.monotonic():
+                    return entry
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    generation = self._generations.get(key[0], 0)
+
+            if not leader:
+                flight.done.wait()
+                if flight.result is not None:
+                    return flight.result
+                continue  # the leader failed, try again (and surface the error if it fails here too)
+
+            try:
+                value = compute()
+                flight.result = CachedReport(value, datetime.now(timezone.utc), time.monotonic() + ttl_seconds)
+                with self._lock:
+                    if self._generations.get(key[0], 0) == generation:
+                        self._prune_expired()
+                        self._entries[key] = flight.result
+                return flight.result
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight.done.set()
+
+    def _prune_expired(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+            del self._entries[key]
+
+    def invalidate(self, report=None):
+        """Drops every parameter set of a report (all reports without one)"""
+        with self._lock:
+            reports = {key[0] for key in self._flights} if report is None else {report}
+            for name in reports:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            if report is None:
+                self._entries.clear()
+                self._flights.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == report]:
+                    del self._entries[key]
+                for key in [key for key in self._flights if key[0] == report]:
+                    del self._flights[key]
+
+
+report_cache = ReportCache()
+
+
+def cached_report(app, report, params, compute):
+    """report_cache.get() with the report's TTL from REPORT_CACHE_TTL_SECONDS"""
+    ttl_seconds = app.config.get('REPORT_CACHE_TTL_SECONDS', {}).get(report, DEFAULT_TTL_SECONDS)
+    return report_cache.get((report,) + tuple(params), ttl_seconds, compute)
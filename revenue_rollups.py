@@ -0,0 +1,305 @@
+from sqlalchemy import func, case, cast, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, DailyRevenue, PizzaDailySales, Order, OrderItem, Customer, Pizza
+from datetime import datetime, timedelta, timezone
+
+'''
+Daily rollups for the reports.
+- DailyRevenue: one row per (day, gender, age bucket, postal code) with order_count and revenue (earnings report)
+- PizzaDailySales: one row per (day, pizza) with quantity, order_count and revenue at unit_price (top pizzas)
+Checkout adds its order with upserts in the same transaction (record_order_revenue, record_pizza_sales),
+the catch-up job rebuilds the last few closed days from Order so anything written around checkout
+(bulk imports, deletes, failed upserts) is corrected. The reports only read the rollups, so their
+cost depends on the number of days and segments, not on the number of orders.
+'''
+
+AGE_BUCKETS = ('18-25', '26-35', '36-50', '51+')
+CATCH_UP_DAYS = 3
+CATCH_UP_LOCK_KEY = 7_020_001  # pg advisory lock key, one catch-up at a time across the workers
+
+
+def age_bucket(dob, on_day):
+    """Age bucket of a customer on a given day (the youngest customers, under 18, count as 18-25)"""
+    if not dob:
+        return AGE_BUCKETS[-1]
+    age = on_day.year - dob.year - ((on_day.month, on_day.day) < (dob.month, dob.day))
+    if age <= 25:
+        return '18-25'
+    elif age <= 35:
+        return '26-35'
+    elif age <= 50:
+        return '36-50'
+    return '51+'
+
+
+def _segment(customer, day):
+    return {
+        'day': day,
+        'gender': customer.gender or '',
+        'age_bucket': age_bucket(customer.dob, day),
+        'postal_code': customer.postal_code or '',
+    }
+
+
+def _upsert_increment(model, key_columns, rows):
+    """INSERT the rows, adding the non-key columns to the existing row on a key conflict"""
+    dialect = db.session.get_bind().dialect.name
+    dialect_insert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}[dialect]
+    statement = dialect_insert(model)
+    keys = {column.key for column in key_columns}
+    statement = statement.on_conflict_do_update(
+        index_elements=key_columns,
+        set_={
+            name: getattr(model, name) + getattr(statement.excluded, name)
+            for name in rows[0] if name not in keys
+        }
+    )
+    db.session.execute(statement, rows)
+
+
+def record_order_revenue(order, customer):
+    """Adds a new order to its rollup row, call before committing the order"""
+    time_stamp = order.time_stamp or datetime.now(timezone.utc)
+    row = _segment(customer, time_stamp.date())
+    row.update(order_count=1, revenue=order.total_price)
+    _upsert_increment(
+        DailyRevenue,
+        [DailyRevenue.day, DailyRevenue.gender, DailyRevenue.age_bucket, DailyRevenue.postal_code],
+        [row]
+    )
+
+
+def record_pizza_sales(order, cart):
+    """Adds the cart lines of a new order to the per-pizza daily counters, call before committing the order"""
+    if not cart:
+        return
+    day = (order.time_stamp or datetime.now(timezone.utc)).date()
+    _upsert_increment(
+        PizzaDailySales,
+        [PizzaDailySales.day, PizzaDailySales.pizza_id],
+        [
+            {
+                'day': day,
+                'pizza_id': int(pizza_id),
+                'quantity': item['quantity'],
+                'order_count': 1,
+                'revenue': round(item['price'] * item['quantity'], 2)
+            }
+            # (day, pizza_id) rows are locked in pizza_id order, two carts with the same pizzas can't deadlock
+            for pizza_id, item in sorted(cart.items(), key=lambda entry: int(entry[0]))
+        ]
+    )
+
+
+def _age_in_years(on_day, dob):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.date_part('year', func.age(on_day, dob))
+    # SQLite has no age(), compare the years and whether the birthday already passed
+    year = lambda value: cast(func.strftime('%Y', value), Integer)
+    month_day = lambda value: func.strftime('%m-%d', value)
+    return year(on_day) - year(dob) - case((month_day(on_day) < month_day(dob), 1), else_=0)
+
+
+def age_bucket_expression(on_day, dob):
+    """SQL version of age_bucket()"""
+    age = _age_in_years(on_day, dob)
+    return case(
+        (dob.is_(None), '51+'),
+        (age <= 25, '18-25'),
+        (age <= 35, '26-35'),
+        (age <= 50, '36-50'),
+        else_='51+'
+    )
+
+
+def _rebuild_revenue_rollups(start_day, end_day):
+    """Recomputes the rollup rows of [start_day, end_day] from Order in one INSERT ... SELECT, returns the rows written"""
+    order_day = func.date(Order.time_stamp)
+    orders = (
+        db.select(
+            order_day.label('day'),
+            func.coalesce(Customer.gender, '').label('gender'),
+            age_bucket_expression(order_day, Customer.dob).label('age_bucket'),
+            func.coalesce(Customer.postal_code, '').label('postal_code'),
+            Order.total_price
+        )
+        .join(Customer, Customer.customer_id == Order.customer_id)
+        .where(
+            Order.time_stamp >= datetime.combine(start_day, datetime.min.time()),
+            Order.time_stamp < datetime.combine(end_day + timedelta(days=1), datetime.min.time())
+        )
+        .subquery()
+    )
+    segments = (
+        db.select(
+            orders.c.day,
+            orders.c.gender,
+            orders.c.age_bucket,
+            orders.c.postal_code,
+            func.count(),
+            func.coalesce(func.sum(orders.c.total_price), 0)
+        )
+        .group_by(orders.c.day, orders.c.gender, orders.c.age_bucket, orders.c.postal_code)
+    )
+
+    db.session.execute(
+        db.delete(DailyRevenue).where(DailyRevenue.day >= start_day, DailyRevenue.day <= end_day)
+    )
+    result = db.session.execute(
+        db.insert(DailyRevenue).from_select(
+            ['day', 'gender', 'age_bucket', 'postal_code', 'order_count', 'revenue'],
+            segments
+        )
+    )
+    return result.rowcount
+
+
+def _rebuild_pizza_sales(start_day, end_day):
+    """Recomputes the per-pizza daily counters of [start_day, end_day] from OrderItem, returns the rows written"""
+    order_day = func.date(Order.time_stamp)
+    sales = (
+        db.select(
+            order_day,
+            OrderItem.pizza_id,
+            func.sum(OrderItem.quantity),
+            func.count(func.distinct(Order.order_id)),
+            func.sum(OrderItem.quantity * OrderItem.unit_price)
+        )
+        .join(Order, Order.order_id == OrderItem.order_id)
+        .where(
+            Order.time_stamp >= datetime.combine(start_day, datetime.min.time()),
+            Order.time_stamp < datetime.combine(end_day + timedelta(days=1), datetime.min.time())
+        )
+        .group_by(order_day, OrderItem.pizza_id)
+    )
+
+    db.session.execute(
+        db.delete(PizzaDailySales).where(PizzaDailySales.day >= start_day, PizzaDailySales.day <= end_day)
+    )
+    result = db.session.execute(
+        db.insert(PizzaDailySales).from_select(
+            ['day', 'pizza_id', 'quantity', 'order_count', 'revenue'],
+            sales
+        )
+    )
+    return result.rowcount
+
+
+def rebuild_revenue_rollups(start_day, end_day):
+    """_rebuild_revenue_rollups() in its own transaction"""
+    written = _rebuild_revenue_rollups(start_day, end_day)
+    db.session.commit()
+    return written
+
+
+def rebuild_pizza_sales(start_day, end_day):
+    """_rebuild_pizza_sales() in its own transaction"""
+    written = _rebuild_pizza_sales(start_day, end_day)
+    db.session.commit()
+    return written
+
+
+def _try_catch_up_lock():
+    """Transaction-scoped advisory lock on Postgres, False when another worker holds it (SQLite runs a single process)"""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return True
+    return db.session.execute(db.select(func.pg_try_advisory_xact_lock(CATCH_UP_LOCK_KEY))).scalar()
+
+
+def _catch_up_range(model, first_source_day, today):
+    """
+    The whole history while the rollup isn't backfilled yet, else the last CATCH_UP_DAYS closed days.
+    first_source_day is the first day the rebuild produces rows for (orders of deleted customers or
+    without items never do), so a complete rollup isn't taken for a missing backfill.
+    """
+    first_rolled_up_day = db.session.query(func.min(model.day)).scalar()
+    if first_rolled_up_day is None or first_source_day < first_rolled_up_day:
+        return first_source_day, today
+    return today - timedelta(days=CATCH_UP_DAYS), today - timedelta(days=1)
+
+
+def _first_day(query):
+    first = query.scalar()
+    return first.date() if first is not None else None
+
+
+def catch_up_revenue_rollups():
+    """
+    Scheduler job. Backfills each rollup while it isn't complete yet, afterwards only rebuilds
+    the last CATCH_UP_DAYS closed days (today is maintained by checkout alone, so a rebuild
+    can't race with its upserts). Returns the number of rollup rows written.
+    Every worker runs the job at startup: both rebuilds share one transaction under an advisory
+    lock, a worker that doesn't get the lock skips the run instead of colliding on the rollup keys.
+    """
+    if not _try_catch_up_lock():
+        db.session.rollback()
+        return 0
+    today = datetime.now(timezone.utc).date()
+    # Same joins as the rebuilds
+    first_revenue_day = _first_day(
+        db.session.query(func.min(Order.time_stamp)).join(Customer, Customer.customer_id == Order.customer_id)
+    )
+    first_sales_day = _first_day(
+        db.session.query(func.min(Order.time_stamp)).join(OrderItem, OrderItem.order_id == Order.order_id)
+    )
+
+    written = 0
+    if first_revenue_day is not None:
+        written += _rebuild_revenue_rollups(*_catch_up_range(DailyRevenue, first_revenue_day, today))
+    if first_sales_day is not None:
+        written += _rebuild_pizza_sales(*_catch_up_range(PizzaDailySales, first_sales_day, today))
+    db.session.commit()
+    return written
+
+
+def revenue_report(segment, start_day=None, end_day=None, limit=None, skip_unknown=False):
+    """
+    [(segment value, order_count, revenue)] grouped by 'gender', 'age_bucket' or 'postal_code', highest revenue first.
+    skip_unknown leaves out the '' segment (customers without a value), before the limit applies.
+    """
+    column = getattr(DailyRevenue, segment)
+    query = db.session.query(
+        column,
+        func.sum(DailyRevenue.order_count),
+        func.sum(DailyRevenue.revenue)
+    )
+    if skip_unknown:
+        query = query.filter(column != '')
+    if start_day:
+        query = query.filter(DailyRevenue.day >= start_day)
+    if end_day:
+        query = query.filter(DailyRevenue.day <= end_day)
+    query = query.group_by(column).order_by(func.sum(DailyRevenue.revenue).desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def pizza_sales_report(start_day=None, end_day=None, limit=None):
+    """[(pizza_id, name, quantity, order_count, revenue)] per pizza, best sellers first"""
+    query = (
+        db.session.query(
+            PizzaDailySales.pizza_id,
+            Pizza.name,
+            func.sum(PizzaDailySales.quantity),
+            func.sum(PizzaDailySales.order_count),
+            func.sum(PizzaDailySales.revenue)
+        )
+        .join(Pizza, Pizza.pizza_id == PizzaDailySales.pizza_id)
+    )
+    if start_day:
+        query = query.filter(PizzaDailySales.day >= start_day)
+    if end_day:
+        query = query.filter(PizzaDailySales.day <= end_day)
+    query = (
+        query.group_by(PizzaDailySales.pizza_id, Pizza.name)
+        .order_by(func.sum(PizzaDailySales.quantity).desc(), PizzaDailySales.pizza_id)
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def top_pizzas_report(days, limit):
+    """pizza_sales_report() of the last `days` days (today included)"""
+    return pizza_sales_report(datetime.now(timezone.utc).date() - timedelta(days=days - 1), limit=limit)
@@ -0,0 +1,53 @@
+from models import db
+import threading
+import traceback
+
+'''
+Tiny in-process scheduler for periodic jobs (batch dispatch, sweepers, reconciliation...).
+Every job runs in its own daemon thread inside an app context. Jobs must be safe to run
+from several worker processes at the same time (they use SKIP LOCKED / idempotent updates).
+'''
+
+
+class PeriodicJob(threading.Thread):
+    def __init__(self, app, name, interval_seconds, func, run_now=False):
+        super().__init__(name=f"job-{name}", daemon=True)
+        self.app = app
+        self.job_name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.run_now = run_now
+        self._stopped = threading.Event()
+
+    def run(self):
+        if self.run_now:
+            self.run_once()
+        while not self._stopped.wait(self.interval_seconds):
+            self.run_once()
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                return self.func()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Job {self.job_name} failed: {str(e)}")
+                traceback.print_exc()
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def add_job(app, name, interval_seconds, func, run_now=False):
+    """
+    Registers a periodic job, it starts right away unless SCHEDULER_ENABLED is off.
+    The first run is one interval later, or immediately with run_now.
+    """
+    jobs = app.extensions.setdefault('scheduler_jobs', {})
+    job = PeriodicJob(app, name, interval_seconds, func, run_now)
+    jobs[name] = job
+    if app.config.get('SCHEDULER_ENABLED', True):
+        job.start()
+    return job